@@ -2,10 +2,26 @@
 Convert primitive `bible.json` to a better structures `bible_clean.json`
 
 Usage:
-    bible_clean.py <input> <output>
+    bible_clean.py <input> <output> [--matrix=<dir> | --no-matrix] [--dedupe | --aliases=<file>]
+
+Either file can be newline-delimited json (`.ndjson`, one ingredient per
+line, see src/utils/ndjson.py).  An `.ndjson` input is cleaned one
+ingredient at a time instead of being loaded whole.
+
+Alongside the output, the weights are also written as an ingredient x
+ingredient sparse matrix with its name <-> id vocabulary, which later
+steps can memory-map (see src/utils/matrix.py).
 
 Options:
-    -h --help   Show this screen.
+    -h --help       Show this screen.
+    --matrix=<dir>  Where to write the weight matrix, by default next to
+                    the output, e.g. data/clean.matrix/ for data/clean.json
+    --no-matrix     Don't write the weight matrix
+    --dedupe        Merge near-duplicate names (see step 8), and write the
+                    aliases found next to the output for review, e.g.
+                    data/clean.aliases.json for data/clean.json
+    --aliases=<file>  Merge names with a reviewed alias map instead,
+                    {"alias": "name to use", ...}
 
 `bible.json` is structurd like this:
     {
@@ -63,117 +79,173 @@ and we want to convert it to this:
 
 6. remove asterisks
 
-"""
+7. merge ingredients that end up with the same name, e.g. `CHEESE` and
+    `CHEESE \u2014 IN GENERAL`; where both list an entry, the stronger
+    rank wins, as it does for entries that end up with the same name
 
-import json
-import sys
-import pandas as pd
+8. with --dedupe, merge near-duplicate names, e.g. `cheese, parmesan`
+    into `parmesan cheese`, or `truffels` into `truffles` (see
+    src/utils/aliases.py); where both list an entry, the stronger wins
 
-def remove_alias(bible):
-    """Remove alias"""
-    for key in list(bible.keys()):
-        if len(bible[key]) < 3:
-            #print("Removing alias entry: {}".format(key))   
-            del bible[key]
+Steps 1-3 and 5-6 run in a single pass over the bible (see
+`key_transforms` and `entry_transforms`), then step 8 and step 4.
 
-def remove_trailing_spaces(bible):
-    """Remove trailing spaces"""
-    for key in list(bible.keys()):
-        if key != key.strip():
-            bible[key.strip()] = bible[key]
-            #print("Renaming key: {} to {}".format(key, key.strip()))
-            del bible[key]
+"""
 
-# [scares me]
-def strip_asterisks(bible):
-    """Strip asterisks"""
-    for key in list(bible.keys()):
-        if '*' in key:
-            bible[key.replace('*', '')] = bible[key]
-            #print("Renaming key: {} to {}".format(key, key.replace('*', '')))
-            del bible[key]
-        for entry in list(bible[key].keys()):
-            if '*' in entry:
-                bible[key][entry.replace('*', '')] = bible[key][entry]
-                #print("Renaming entry: {} to {}".format(entry, entry.replace('*', '')))
-                del bible[key][entry]
-
-def remove_general(bible):
+import json
+import os.path
+from collections import Counter
+from docopt import docopt
+from src.utils.ndjson import is_ndjson, iter_records, write_records
+from src.utils.matrix import matrixBuilder
+from src.utils.aliases import find_aliases
+
+##
+# Transforms
+##  each ingredient is normalized in one traversal: its key goes through
+#   key_transforms, and each entry through entry_transforms, in order.
+#   To add a step, append a function to either list.
+
+def is_alias(entries):
+    """Alias entries are just a title and a pointer"""
+    return len(entries) < 3
+
+def is_source_entry(i, value):
+    """The first entry is the source ingredient itself"""
+    return i == 0 and value == 0
+
+def remove_general(key):
     """Remove general"""
-    for key in list(bible.keys()):
-        # the epub uses a different dash sometimes: '-' vs '\u2014'
-        if '\u2014 IN GENERAL' in key or '- IN GENERAL' in key:
-            bible[key.replace('\u2014 IN GENERAL', '').replace('- IN GENERAL', '')] = bible[key]
-            #print("Renaming key: {} to {}".format(key, key.replace('\u2014 IN GENERAL', '').replace('- IN GENERAL', '')))
-            del bible[key]
-
-def remove_first_entry(bible):
-    """Remove first entry"""
-    for key in list(bible.keys()):
-        if list(bible[key].values())[0] == 0:
-            del bible[key][list(bible[key].keys())[0]]
-
-def remove_see_also(bible):
-    """Remove see also"""
-    for key in list(bible.keys()):
-        for entry in list(bible[key].keys()):
-            if '(See' in entry:
-                #print("Removing entry: {}".format(entry))
-                del bible[key][entry]
+    # the epub uses a different dash sometimes: '-' vs '\u2014'
+    return key.replace('\u2014 IN GENERAL', '').replace('- IN GENERAL', '')
 
-# TODO: these last four functions are all the same logic, 
-#       so we should combine them into one function
+# [scares me]
+def strip_asterisks(x):
+    """Strip asterisks"""
+    return x.replace('*', '')
 
-def convert_to_lower_case(bible):
+def convert_to_lower_case(key):
     """Convert to lower case"""
-    for key in list(bible.keys()):
-        if key.lower() != key:
-            bible[key.lower()] = bible[key]
-            del bible[key]
+    return key.lower()
+
+def remove_trailing_spaces(key):
+    """Remove trailing spaces"""
+    return key.strip()
+
+def remove_see_also(entry):
+    """Remove see also"""
+    if '(See' in entry:
+        return None
+    return entry
+
+# key -> key
+key_transforms = [remove_general, strip_asterisks, convert_to_lower_case,
+                  remove_trailing_spaces]
+
+# entry -> entry, or None to remove it
+entry_transforms = [strip_asterisks, remove_see_also]
+
+def normalize_record(key, entries):
+    """Normalize one ingredient, or None if it's dropped"""
+    if is_alias(entries):
+        return None
+    for transform in key_transforms:
+        key = transform(key)
+
+    normalized = {}
+    renamed = {}
+    for i, (entry, value) in enumerate(entries.items()):
+        if is_source_entry(i, value):
+            continue
+        name = entry
+        for transform in entry_transforms:
+            name = transform(name)
+            if name is None:
+                break
+        if name is None:
+            continue
+        if name != entry:
+            renamed[name] = value
+        else:
+            normalized[name] = value
+    # renamed entries go last, e.g. '*garlic' after 'garlic'
+    for name, value in renamed.items():
+        normalized[name] = stronger(normalized.pop(name), value) if name in normalized else value
+    return key, normalized
+
+def is_rank(value):
+    return isinstance(value, (int, float))
+
+def stronger(value, other):
+    """The stronger of two ranks, by weight; the first if they tie"""
+    if not (is_rank(value) and is_rank(other)):
+        return value
+    if convertRank.to_weight(other) > convertRank.to_weight(value):
+        return other
+    return value
+
+def merge_entries(entries, other):
+    """Merge two ingredients that end up with the same name
+
+    Entries of both are kept; where both have one, the stronger wins.
+    """
+    merged = dict(entries)
+    for entry, value in other.items():
+        merged[entry] = stronger(merged[entry], value) if entry in merged else value
+    return merged
+
+def count_entries(bible):
+    """Count the ingredients each entry is mentioned in"""
+    return Counter(entry for entries in bible.values() for entry in entries)
+
+def report_pruned(counts, n):
+    kept = sum(1 for count in counts.values() if count > n)
+    print('Kept {} entries, dropped {} mentioned {} times or less'.format(
+        kept, len(counts) - kept, n))
 
 def remove_empty_keys(bible, n):
-    """Get total count"""
-
-    # convert to dataframe to sort, then convert
-    # back to dict (annoying)
-    df = pd.DataFrame.from_dict(bible, orient='index')
-    df = df.sum(axis=1, numeric_only=True)
-    df = df.sort_values(ascending=False)
-    df = df.to_dict()
-
-    entry_keys = []
-    entry_dict = {}
-    for key in list(bible.keys()):
-        for entry in list(bible[key].items()):
-            entry_key = entry[0]
-            # we need to make a running list of all the 
-            # entry keys so we can determine how many times
-            # an entry is mentioned anywhere in the bible
-            if entry_key not in entry_keys:
-                entry_keys.append(entry_key)
-                entry_dict[entry_key] = 1
-            else:
-                entry_dict[entry_key] += 1
-
-    # sort the entry_dict by the number of times it appears
-    df = pd.DataFrame.from_dict(entry_dict, orient='index')
-    df = df.sort_values(0, ascending=False)
-    df = df.to_dict()
-
-    # now reconstruct df to only include key entries 
-    # that have more than 2 appearances
-    df = pd.DataFrame.from_dict({key: value for key, value in df[0].items() if value > n}, orient='index')  
-    df = df.sort_values(0, ascending=False)
-    df = df.to_dict()
-
-    # for all keys, remove entries
-    # that are not in the dataframe
-    for key in list(bible.keys()):
-        for entry in list(bible[key].items()):
-            if entry[0] not in df[0].keys():
-                del bible[key][entry[0]]
-
-    return df
+    """Remove entries mentioned n times or less"""
+    counts = count_entries(bible)
+    for entries in bible.values():
+        for entry in [entry for entry in entries if counts[entry] <= n]:
+            del entries[entry]
+    report_pruned(counts, n)
+    return counts
+
+##
+# Near-duplicates
+##  found over every name in the bible, keys and entries alike
+
+def find_bible_aliases(bible):
+    """Find near-duplicate names among the keys and entries of the bible"""
+    counts = Counter(entry for entries in bible.values()
+                     for entry, value in entries.items() if is_rank(value))
+    names = set(bible) | set(counts)
+    return find_aliases(sorted(names), counts, sources=bible)
+
+def dedupe_record(key, entries, aliases):
+    """Rename the entries of an ingredient, keeping the stronger rank"""
+    deduped = {}
+    for entry, value in entries.items():
+        if is_rank(value):
+            entry = aliases.get(entry, entry)
+            if entry == key:
+                continue
+        deduped[entry] = stronger(deduped[entry], value) if entry in deduped else value
+    return deduped
+
+def dedupe_bible(bible, aliases):
+    """Merge the names in aliases into the names they map to"""
+    deduped = {}
+    for key, entries in bible.items():
+        name = aliases.get(key, key)
+        entries = dedupe_record(name, entries, aliases)
+        if name in deduped:
+            print('Merging {} into {}'.format(key, name))
+            entries = merge_entries(deduped[name], entries)
+        deduped[name] = entries
+    bible.clear()
+    bible.update(deduped)
 
 def is_bible_modified(old_bible, new_bible):
     """Is bible modified"""
@@ -187,20 +259,34 @@ def is_bible_modified(old_bible, new_bible):
     else:
         print("Bible has not been modified")
 
+def normalize_bible(bible):
+    """Normalize keys and entries, in a single pass"""
+    normalized = {}
+    for key, entries in bible.items():
+        record = normalize_record(key, entries)
+        if record is None:
+            continue
+        name, entries = record
+        if name in normalized:
+            print('Merging {} into {}'.format(key, name))
+            entries = merge_entries(normalized[name], entries)
+        normalized[name] = entries
+    bible.clear()
+    bible.update(normalized)
+
 # clean the bible
-def clean_bible(bible):
-    """Clean bible"""
-    remove_alias(bible)
-    remove_general(bible)
-    remove_first_entry(bible)
-    strip_asterisks(bible)
-    convert_to_lower_case(bible)
-    remove_see_also(bible)
-    remove_trailing_spaces(bible)
+def clean_bible(bible, dedupe=False, aliases=None):
+    """Clean bible, returning the aliases merged with dedupe"""
+    normalize_bible(bible)
+    if dedupe:
+        if aliases is None:
+            aliases = find_bible_aliases(bible)
+        dedupe_bible(bible, aliases)
     # get the total count of appearances for each
     # entry in the bible, and remove entries that
     # only appear less than n times
     remove_empty_keys(bible, n=2)
+    return aliases
 
 # write the bible
 def write_bible(bible, output):
@@ -238,16 +324,117 @@ def apply_weight(bible):
                 continue
             bible[key][entry] = convertRank.to_weight(rank)
 
+##
+# Streaming
+##  the same cleaning, one ingredient (record) at a time
+
+def iter_normalized(input, sources):
+    """Yield each normalized ingredient once all its records are merged
+
+    sources maps each name to the keys it is normalized from, in the
+    order the keys first appear, as they would be ordered in a dict.
+    """
+    last = {key: i for keys in sources.values() for key, i in keys}
+    pending = {}
+    for i, (key, entries) in enumerate(iter_records(input)):
+        # as in a dict, only the last record of a key counts
+        if last.get(key) != i:
+            continue
+        name, entries = normalize_record(key, entries)
+        keys = sources[name]
+        if len(keys) == 1:
+            yield name, entries
+            continue
+        pending.setdefault(name, {})[key] = entries
+        if len(pending[name]) == len(keys):
+            parts = pending.pop(name)
+            merged = parts[keys[0][0]]
+            for key, _ in keys[1:]:
+                merged = merge_entries(merged, parts[key])
+            yield name, merged
+
+def clean_records(input, n=2):
+    """Clean an ndjson bible, yielding one ingredient at a time
+
+    The file is read three times: to find which keys each normalized name
+    comes from, to count how often each entry is mentioned, and to prune,
+    weight and yield the ingredients.  Only keys, counts and the
+    ingredients still waiting on a merge stay in memory.
+    """
+    # 1. where each key first and last appears, and what it becomes
+    first, last, names = {}, {}, {}
+    for i, (key, entries) in enumerate(iter_records(input)):
+        first.setdefault(key, i)
+        last[key] = i
+        record = normalize_record(key, entries)
+        names[key] = record[0] if record else None
+    sources = {}
+    for key in sorted(first, key=first.get):
+        if names[key] is None:
+            continue
+        if names[key] in sources:
+            print('Merging {} into {}'.format(key, names[key]))
+        sources.setdefault(names[key], []).append((key, last[key]))
+
+    # 2. count the appearances of each entry, cf. remove_empty_keys
+    counts = Counter()
+    for name, entries in iter_normalized(input, sources):
+        counts.update(entries.keys())
+    report_pruned(counts, n)
+
+    # 3. remove entries that appear n times or less, then weigh
+    for name, entries in iter_normalized(input, sources):
+        bible = {name: {k: v for k, v in entries.items() if counts[k] > n}}
+        apply_weight(bible)
+        yield name, bible[name]
+
+def collect_matrix(records, matrix):
+    """Pass records through, adding each to the matrix"""
+    for key, entries in records:
+        matrix.add(key, entries)
+        yield key, entries
+
 def main():
     """Main"""
-    input = sys.argv[1]
-    output = sys.argv[2]
-    with open(input) as file:
-        bible = json.load(file)
-    clean_bible(bible)
-    apply_weight(bible)
+    args = docopt(__doc__)
+    input = args['<input>']
+    output = args['<output>']
+    dedupe = args['--dedupe'] or args['--aliases'] is not None
+    aliases = None
+    if args['--aliases']:
+        with open(args['--aliases']) as file:
+            aliases = json.load(file)
+    if is_ndjson(input) and not dedupe:
+        records = clean_records(input)
+    else:
+        # finding aliases takes every name at once, so an ndjson bible
+        # is loaded whole for it
+        if is_ndjson(input):
+            bible = dict(iter_records(input))
+        else:
+            with open(input) as file:
+                bible = json.load(file)
+        if args['--dedupe']:
+            aliases = clean_bible(bible, dedupe=True)
+            aliases_file = os.path.splitext(output)[0] + '.aliases.json'
+            with open(aliases_file, 'w') as file:
+                json.dump(aliases, file, indent=2, sort_keys=True)
+            print('Merged {} aliases, see {}'.format(len(aliases), aliases_file))
+        else:
+            clean_bible(bible, dedupe, aliases)
+        apply_weight(bible)
+        records = sorted(bible.items())
+    if not args['--no-matrix']:
+        matrix = matrixBuilder()
+        records = collect_matrix(records, matrix)
     # write the new bible
-    write_bible(bible, output)
+    if is_ndjson(output):
+        with open(output, 'w') as file:
+            write_records(file, records, sort_keys=True)
+    else:
+        write_bible(dict(records), output)
+    if not args['--no-matrix']:
+        matrix.save(args['--matrix'] or os.path.splitext(output)[0] + '.matrix')
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,16 +1,27 @@
 """Create nodes and edges from cleaned data.
 
 Usage:
-    graph.py <input_file> <output_file_edges> <output_file_nodes>
+    graph.py <input_file> <output_file_edges> <output_file_nodes> [--undirected] [--combine=<how>]
+             [--index=<dir> | --no-index] [--no-centrality]
 
 Options:
-    -h --help     Show this screen.
+    -h --help         Show this screen.
+    --undirected      Merge A->B and B->A into one edge, marked "reciprocal".
+    --combine=<how>   How the weights of a merged edge combine: max, sum or
+                      mean [default: max].
+    --index=<dir>     Where to write the adjacency index for tools/slice.py,
+                      by default next to the edges, e.g. data/edges.index/
+                      for data/edges.json
+    --no-index        Don't write the adjacency index
+    --no-centrality   Don't compute pagerank, eigenvector and community
 
 This script creates a file with the edges and a file with the nodes from the cleaned
 data (output of clean.py). The output files are used as input for the
 create_graph.py script.
 
-Both the input and output files are assumed to be json files.
+Both the input and output files are assumed to be json files.  The input
+can also be newline-delimited json (`.ndjson`), which is read one
+ingredient at a time.
 
 nodes.json (a list of dicts of key-value pairs):
 
@@ -28,6 +39,10 @@ nodes.json (a list of dicts of key-value pairs):
   { /* ... */ }
 ]
 
+Each node also has its weighted "pagerank", "eigenvector" centrality and
+"community" number, the largest community first (see
+src/utils/centrality.py), unless --no-centrality.
+
 edges.json (a list of dicts of source and target nodes):
 [
   {
@@ -43,6 +58,14 @@ edges.json (a list of dicts of source and target nodes):
   { /* ... */ }
 ]
 
+With --undirected, each pair of ingredients has one edge, where the
+first of the two directions was, and "reciprocal" says whether both
+ingredients list each other.  The influence of a node then counts the
+merged edges.
+
+The adjacency index (see src/utils/adjacency.py) holds the same edges
+by node id, in the order of nodes.json.
+
 cleaned_data.json (a dict of dicts of key-value pairs):
 {
   "garlic": {
@@ -63,17 +86,88 @@ cleaned_data.json (a dict of dicts of key-value pairs):
 """
 
 import json
+import os.path
+from array import array
 from docopt import docopt
+import numpy as np
 import pandas as pd
+from scipy import sparse
+from src.utils.adjacency import write_index
+from src.utils.centrality import (communities, eigenvector_centrality, modularity,
+                                  pagerank, weight_matrix)
+from src.utils.ndjson import is_ndjson, iter_records
+
+def read_edges(records):
+    """The edges as columns: the names, and from ids, to ids and weights
+
+    Names are interned in the order they are first seen, and the edges
+    kept in input order.  'topics' and 'affinities' aren't edges.
+    """
+    ids = {}
+    sources, targets, weights = array('q'), array('q'), []
+    for key, value in records:
+        source = ids.setdefault(key, len(ids))
+        for k, v in value.items():
+            if k not in ('topics', 'affinities'):
+                sources.append(source)
+                targets.append(ids.setdefault(k, len(ids)))
+                weights.append(v)
+    # one dtype for the column, as the DataFrame used to give it
+    return (list(ids), np.frombuffer(sources, dtype=np.int64),
+            np.frombuffer(targets, dtype=np.int64), np.array(weights))
+
+def influence(n, sources, targets):
+    """How many edges each node is in, going out plus coming in"""
+    return np.bincount(sources, minlength=n) + np.bincount(targets, minlength=n)
+
+combiners = ('max', 'sum', 'mean')
+
+def undirected(n, sources, targets, weights, combine='max'):
+    """Merge reciprocal edges, returning the edge columns and a reciprocal flag
 
-def show_stats(nodes, edges):
+    Each merged edge keeps the direction and position of whichever of the
+    two came first.
+    """
+    pairs = np.minimum(sources, targets) * n + np.maximum(sources, targets)
+    _, first, inverse, counts = np.unique(pairs, return_index=True,
+                                          return_inverse=True, return_counts=True)
+    if combine == 'max':
+        combined = np.full(len(first), -np.inf) if len(weights) else np.empty(0)
+        np.maximum.at(combined, inverse, weights)
+    else:
+        combined = np.bincount(inverse, weights=weights, minlength=len(first))
+        if combine == 'mean':
+            combined = combined / counts
+    # integer weights stay integers, unless averaged
+    if combine != 'mean' and weights.dtype.kind in 'iu':
+        combined = combined.astype(weights.dtype)
+
+    # back to input order
+    order = np.argsort(first, kind='stable')
+    keep = first[order]
+    return sources[keep], targets[keep], combined[order], counts[order] > 1
+
+def write_records(f, columns):
+    """Stream records given as columns of json-encoded values
+
+    Laid out like json.dump(records, f, indent=2, sort_keys=True).
+    """
+    keys = sorted(columns)
+    fields = ['\n    {}: '.format(json.dumps(key)) for key in keys]
+    sep = '['
+    for row in zip(*(columns[key] for key in keys)):
+        body = ','.join(field + value for field, value in zip(fields, row))
+        f.write(sep + '\n  {' + body + '\n  }')
+        sep = ','
+    f.write('\n]' if sep == ',' else '[]')
+
+def show_stats(nodes, n_edges):
     print('Number of nodes: {}'.format(len(nodes)))
-    print('Number of edges: {}'.format(len(edges)))
+    print('Number of edges: {}'.format(n_edges))
 
     # most influential nodes
     print('Most influential nodes:')
-    df_nodes = pd.DataFrame(nodes)
-    df_nodes = df_nodes.sort_values(by='influence', ascending=False)
+    df_nodes = nodes.sort_values(by='influence', ascending=False)
     # only show label and influence
     df_nodes = df_nodes[['label', 'influence']]
     print(df_nodes.head(5))
@@ -82,6 +176,11 @@ def show_stats(nodes, edges):
     print('There are {} nodes with only one edge.'.format(len(df_nodes[df_nodes['influence'] == 1])))
     print('There are {} nodes with only two edges.'.format(len(df_nodes[df_nodes['influence'] == 2])))
 
+    if 'pagerank' in nodes:
+        print('Highest pagerank:')
+        top = nodes.sort_values(by='pagerank', ascending=False)
+        print(top[['label', 'pagerank', 'community']].head(5))
+
     percent_active = len(df_nodes[df_nodes['influence'] > 10]) / len(df_nodes) * 100
     # use two decimal places for the percentage
     percent_active = round(percent_active, 2)
@@ -94,61 +193,81 @@ def main():
     input_file = args['<input_file>']
     output_file_edges = args['<output_file_edges>']
     output_file_nodes = args['<output_file_nodes>']
+    combine = args['--combine']
+    index = None
+    if not args['--no-index']:
+        index = args['--index'] or os.path.splitext(output_file_edges)[0] + '.index'
+
+    if combine not in combiners:
+        raise ValueError('--combine must be one of {}'.format(', '.join(combiners)))
 
     if input_file == output_file_edges or input_file == output_file_nodes:
         raise ValueError('input and output files cannot be the same')
     
     # Read the data from the input file
-    with open(input_file, 'r') as f:
-        data = json.load(f)
+    if is_ndjson(input_file):
+        records = iter_records(input_file)
+    else:
+        with open(input_file, 'r') as f:
+            records = json.load(f).items()
 
-    # Create a list of nodes, and don't use 'topics' as a node
-    # or 'affinities' as a node
-    nodes = []
-    for key, value in data.items():
-        for k, v in value.items():
-            if k not in ['topics', 'affinities']:
-                nodes.append(k)
+    names, sources, targets, weights = read_edges(records)
 
-    # Remove duplicates from the list of nodes
-    nodes = list(set(nodes))
-    print('Number of nodes after removing duplicates: {}'.format(len(nodes)))
+    print('Number of nodes after removing duplicates: {}'.format(len(np.unique(targets))))
 
-    # Create a list of edges
-    edges = []
-    for key, value in data.items():
-        for k, v in value.items():
-            if k not in ['topics', 'affinities']:
-                edges.append((key, k, v))
+    columns = {}
+    reciprocal = None
+    if args['--undirected']:
+        sources, targets, weights, reciprocal = undirected(len(names), sources, targets,
+                                                           weights, combine)
+        columns['reciprocal'] = map(json.dumps, reciprocal.tolist())
+        print('Number of reciprocal edges merged: {}'.format(int(reciprocal.sum())))
 
-    # Create a dataframe from the list of edges
-    df = pd.DataFrame(edges, columns=['from', 'to', 'weight'])
+    # a node is any name in an edge, listed by name; a source
+    # ingredient without edges isn't one
+    degree = influence(len(names), sources, targets)
+    order = sorted(np.flatnonzero(degree).tolist(), key=names.__getitem__)
 
-    # Create a dataframe with the number of times each node
-    #  appears as a source or target node
-    df_nodes = pd.DataFrame(df.groupby('from').size(), columns=['influence'])
-    # Concatenate: 
-    df_nodes = pd.concat([df_nodes, pd.DataFrame(df.groupby('to').size(), columns=['influence'])])
-    df_nodes = df_nodes.groupby(df_nodes.index).sum()
+    # by position in nodes.json
+    node_id = np.empty(len(names), dtype=np.int64)
+    node_id[order] = np.arange(len(order))
 
-    # Create a list of dicts of nodes
-    nodes = []
-    for index, row in df_nodes.iterrows():
-        nodes.append({'id': index, 'label': index, 'influence': row['influence']})
+    # each name is encoded once, and looked up by id per edge
+    encoded = [json.dumps(name) for name in names]
+    labels = [encoded[i] for i in order]
+    node_columns = {'id': labels, 'label': labels,
+                    'influence': map(str, degree[order].tolist())}
+    nodes = pd.DataFrame({'id': [names[i] for i in order], 'influence': degree[order]})
 
-    # Create a sorted list of dicts of edges 
-    edges = []
-    for index, row in df.iterrows():
-        edges.append({'from': row['from'], 'to': row['to'], 'weight': row['weight']})
+    if not args['--no-centrality']:
+        W = weight_matrix(len(order), node_id[sources], node_id[targets], weights)
+        # the weights both ways, an ingredient listing itself once; an
+        # undirected graph has its edges one way only
+        S = (W + W.T - sparse.diags(W.diagonal())).tocsr()
+        nodes['pagerank'] = pagerank(S if args['--undirected'] else W)
+        nodes['eigenvector'] = eigenvector_centrality(S)
+        nodes['community'] = communities(S)
+        for key in ('pagerank', 'eigenvector', 'community'):
+            node_columns[key] = map(json.dumps, nodes[key].tolist())
+        print('Number of communities: {}, with a modularity of {:.3f}'.format(
+            nodes['community'].nunique(), modularity(S, nodes['community'].values)))
 
     # Write the nodes and edges to files
     with open(output_file_nodes, 'w') as f:
-        json.dump(nodes, f, indent=2, sort_keys=True, default=lambda o: o.tolist())
+        write_records(f, node_columns)
     with open(output_file_edges, 'w') as f:
-        json.dump(edges, f, indent=2, sort_keys=True, default=lambda o: o.tolist())
+        columns.update({'from': [encoded[i] for i in sources.tolist()],
+                        'to': [encoded[i] for i in targets.tolist()],
+                        'weight': map(json.dumps, weights.tolist())})
+        write_records(f, columns)
+
+    if index:
+        write_index(index, [names[i] for i in order], node_id[sources], node_id[targets],
+                    weights, reciprocal)
 
     # Show some stats
-    show_stats(nodes, edges)
+    nodes['label'] = nodes['id']
+    show_stats(nodes, len(sources))
 
 if __name__ == '__main__':
     main()
@@ -2,7 +2,20 @@
 
 """
 
-Usage: python ./parse.py  
+Usage:
+    parse.py [--jobs=<n>] [--cache=<dir> | --no-cache]
+    parse.py --ndjson
+
+Options:
+    -h --help       Show this screen.
+    --jobs=<n>      Number of worker processes; each chapter file is parsed
+                    in its own process [default: 1]
+    --cache=<dir>   Where to keep parsed chapters, so that a rerun only
+                    parses the chapters whose file or parse rules changed
+                    [default: ./data/cache/parse/]
+    --no-cache      Parse every chapter, and don't touch the cache
+    --ndjson        Write data/bible.ndjson instead, one ingredient per
+                    line as each one is parsed
 
 The purpose of this code is to create a database with an assumed seven 
 rankings in "The Flavor Bible" and related literature for the strengths
@@ -48,12 +61,20 @@ and interactively chart a course in recipe creation.
 
 """
 
-from bs4 import BeautifulSoup
 import re
 import glob
+from collections import namedtuple
 import os.path
 import json
+import hashlib
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from docopt import docopt
 import src.utils.brackets as pb
+import src.utils.genres
+import src.utils.paragraphs
+from src.utils.paragraphs import comment, iter_paragraphs
+from src.utils.ndjson import write_records
 from src.utils.genres import isCulinaryGroup
 
 ##
@@ -66,7 +87,7 @@ from src.utils.genres import isCulinaryGroup
 
 # This only works for singleton ingredients:
 def what_rank(x):
-    if x.find_all(re.compile("^strong")):
+    if x.strongs:
         if "*" in x.text:
             rank = 1
         elif isCap(x.text):
@@ -77,17 +98,75 @@ def what_rank(x):
         rank = 4
     return rank
 
-def rank_subtags(Y, ptag):
+##
+# Spans
+##  a paragraph is tokenized once into its list items, so each item's rank
+#   is a lookup rather than a substring scan over every <strong>
+
+# text:     the item, as printed
+# bold:     whether any of it is set in <strong>
+# caps:     whether it is in CAPS
+# asterisk: whether it is marked with a '*'
+Span = namedtuple('Span', ['text', 'bold', 'caps', 'asterisk'])
+
+separators = re.compile(r'([,:;()])')
+
+def tokenize_spans(ptag):
+    """Split a paragraph's runs into its list items, in order"""
+    spans = []
+    pieces, bold = [], False
+    for text, run_bold in ptag.runs:
+        for piece in separators.split(text):
+            if separators.fullmatch(piece):
+                spans.append(make_span(pieces, bold))
+                pieces, bold = [], False
+                continue
+            pieces.append(piece)
+            if run_bold and piece.strip():
+                bold = True
+    spans.append(make_span(pieces, bold))
+    return [span for span in spans if span.text]
+
+def make_span(pieces, bold):
+    text = ''.join(pieces).strip()
+    return Span(text, bold, isCap(text), "*" in text)
+
+def span_rank(span):
     def rank(x): return 4 - x
-    y = [rank(0) for y_i in Y]
-    s_tags=ptag.find_all('strong')
-    for s_tag in s_tags:
-        for j in range(len(Y)):
-            Y[j] = Y[j].strip()
-            if Y[j] in s_tag.text:
-                y[j] = rank(1)
-                if Y[j].isupper(): y[j] -= 1
-                if "*" in Y[j]: y[j] -= 1
+    if not span.bold:
+        return rank(0)
+    r = rank(1)
+    if span.caps: r -= 1
+    if span.asterisk: r -= 1
+    return r
+
+def span_key(x):
+    x = x.lower().strip('*').strip()
+    return re.sub(r'^(esp\.|e\.g\.,?)\s*', '', x)
+
+def rank_subtags(Y, ptag, genre=None):
+    """Rank the items Y of a paragraph by how they are set in it
+
+    Items are matched whole, so "oil" does not pick up the rank of "olive
+    oil".  Items that orient put together with the genre, like "balsamic
+    vinegar" from "vinegar: balsamic", take the rank of their species.
+    """
+    ranks = {}
+    for span in tokenize_spans(ptag):
+        key = span_key(span.text)
+        ranks[key] = min(ranks.get(key, 4), span_rank(span))
+
+    genre = span_key(genre) if genre else None
+    y = []
+    for j in range(len(Y)):
+        Y[j] = Y[j].strip()
+        key = span_key(Y[j])
+        if key not in ranks and genre:
+            if key.endswith(' ' + genre):
+                key = key[:-len(genre)].strip()
+            elif key.startswith(genre + ' '):
+                key = key[len(genre):].strip()
+        y.append(ranks.get(key, 4))
     return Y, y
 
 def isCap(x) : return x.isupper()
@@ -133,228 +212,411 @@ topics = ["Season:",
           # "Tips:" has its own class=ul3, but some other content 
           # falls in that class, too.  [errata] 
 
-# in the beginning..
-bible = {}
+##
+# In the source files of the book, FlavorBible_chap-3*.html, the source 
+# ingredient is given by .lh1, but sometimes .lh, while the friendly, 
+# enemy, and super-alliance ingredients are captured by .ul and .ul1 
+# within the .lh* bounds (so is some metadata that will be useful later)
+##
+classes = ["lh","lh1","ul","ul1","ul3"]
 
 input_dir = "./data/bible/"
 input_files = "FlavorBible_chap-3*.html"
 
-for input_file in glob.glob(os.path.join(input_dir, input_files)):
-    with open(input_file) as markup:
-
-        soup = BeautifulSoup(markup, features="html.parser")
-        ##
-        # In the source files of the book, FlavorBible_chap-3*.html, the source 
-        # ingredient is given by .lh1, but sometimes .lh, while the friendly, 
-        # enemy, and super-alliance ingredients are captured by .ul and .ul1 
-        # within the .lh* bounds (so is some metadata that will be useful later)
-        ##
-        classes = ["lh","lh1","ul","ul1","ul3"]
-        ptags = soup.find_all("p", class_=classes)   
-
-        # build the dictionary from each input html chapter file
-        for ptag in ptags:
-
-            ##
-            # SOURCES
-            ##  determine the titular ingredients
-
-            T = list(ptag.children)
-
-            if ptag['class'] == ['lh'] or ptag['class'] == ['lh1']:
-                flag = 0
-                dummy_array=[]
-                dummy_dict={}
-                ###
-                # Sometimes, the title tags concatenate mistakenly:
-                #
-                # <p class="lh">WALNUT OIL <strong>(See Oil, Walnut)</strong>
-                #   WALNUTS <strong>(See also Nuts — In General)</strong></p>
-                #
-                # or just have special references:
-                #
-                # <p class="lh1">ANISE <strong>(See also Anise, Star, and Fennel)</strong></p>
-                #
-                # In first case, the initial title (WALNUT OIL) is actually a pointer 
-                # to  another entry somewhere else in the book (OIL, WALNUT), as no
-                # ingredient line items are present.  On the other hand, the second 
-                # title (WALNUTS) should be treated as the real title to the following
-                # list of ingredients, and its parens (i.e. Nuts — In General) treated 
-                # as rank-1 (holy grail), for now..
-                ###
-                # TODO: can this routine be used for all titles?
-                if len(T) > 1:
-                    for i in range(len(T)):
-                        if (T[i]).text.isupper():
-                            title = T[i].strip()
-                            bible[title] = {title.lower():0}
-                        else: continue
-                        # capture topic that got mistaken with 'lh1':
-                        if "Weight:" in ptag.text:
-                            topic = "Weight:"
-                            title = T[0].strip()
-                            matter = T[2].strip()
-                            dummy_dict.update( {topic.replace(':',''):matter} )
-                            continue
-                        if i < len(T)-1:
-                            desc = (T[i+1]).text.strip()
-                            bible[title][desc] = 1
-                            continue
-                        else: continue
+def chapter_files(input_dir=input_dir, input_files=input_files):
+    """The book's chapter files, in the order they are parsed"""
+    return glob.glob(os.path.join(input_dir, input_files))
+
+def read_paragraphs(source):
+    """The paragraphs of a chapter, given its path or an open file"""
+    if hasattr(source, 'read'):
+        yield from iter_paragraphs(source, classes)
+    else:
+        with open(source) as markup:
+            yield from iter_paragraphs(markup, classes)
+
+class parseState:
+    """The running title and metadata between paragraphs"""
+    def __init__(self):
+        self.title = None
+        self.flag = 0
+        self.dummy_array = []
+        self.dummy_dict = {}
+
+def is_title(ptag):
+    return ptag.classes == ['lh'] or ptag.classes == ['lh1']
+
+def parse_ptag(bible, state, ptag):
+    """Parse a single paragraph into the bible"""
+
+    ##
+    # SOURCES
+    ##  determine the titular ingredients
+
+    # the children's text, and their strings, which differ for a comment:
+    # it has no text, but its string is what it says
+    T = ['' if tag == comment else text for text, tag in ptag.children]
+    S = [text for text, tag in ptag.children]
+
+    if is_title(ptag):
+        state.flag = 0
+        state.dummy_array=[]
+        state.dummy_dict={}
+        ###
+        # Sometimes, the title tags concatenate mistakenly:
+        #
+        # <p class="lh">WALNUT OIL <strong>(See Oil, Walnut)</strong>
+        #   WALNUTS <strong>(See also Nuts — In General)</strong></p>
+        #
+        # or just have special references:
+        #
+        # <p class="lh1">ANISE <strong>(See also Anise, Star, and Fennel)</strong></p>
+        #
+        # In first case, the initial title (WALNUT OIL) is actually a pointer 
+        # to  another entry somewhere else in the book (OIL, WALNUT), as no
+        # ingredient line items are present.  On the other hand, the second 
+        # title (WALNUTS) should be treated as the real title to the following
+        # list of ingredients, and its parens (i.e. Nuts — In General) treated 
+        # as rank-1 (holy grail), for now..
+        ###
+        # TODO: can this routine be used for all titles?
+        if len(T) > 1:
+            for i in range(len(T)):
+                if T[i].isupper():
+                    state.title = T[i].strip()
+                    bible[state.title] = {state.title.lower():0}
+                else: continue
+                # capture topic that got mistaken with 'lh1':
+                if "Weight:" in ptag.text:
+                    topic = "Weight:"
+                    state.title = S[0].strip()
+                    matter = S[2].strip()
+                    state.dummy_dict.update( {topic.replace(':',''):matter} )
                     continue
-                else:     
-                    title = remove_parens(ptag.text) #double check what's going on here
-                    bible[title] = {ptag.text.lower():flag}
+                if i < len(T)-1:
+                    desc = T[i+1].strip()
+                    bible[state.title][desc] = 1
                     continue
-            # [errata] capture titles that got mistaken with 'ul':
-            #   <p class="ul">ZUCCHINI BLOSSOMS <strong>(See also Zucchini)</strong></p>
-            elif T[0].text.isupper() and ptag.find('strong').previous_sibling:
-                flag = 0
-                title = T[0].strip()
-                bible[title] = {title.lower():flag}
-                bible[title][ptag.find_next('strong').text] = 1
-                continue
-
-            ##
-            # METADATA
-            ##  capture affinities as raw list for each titular ingredient dictionary
-
-            if contains_affinity(ptag.text):
-                # will be useful for training the flavor model
-                dummy_array.append(ptag.text) 
-                bible[title]['affinities'] = dummy_array
-                continue
-
-            # rule for non-unanimous consensus of flavor nemeses
-            if flag == 1:
-                qual = "say some"
-                if qual in ptag.text:
-                    bible[title][remove_parens(ptag.text)] = -flag/2.
-                else: 
-                    bible[title][remove_parens(ptag.text)] = -flag/1.
-                continue
-            if contains_avoid(ptag.text):
-                flag = 1
-                continue
+                else: continue
+            return
+        else:     
+            state.title = remove_parens(ptag.text) #double check what's going on here
+            bible[state.title] = {ptag.text.lower():state.flag}
+            return
+    # [errata] capture titles that got mistaken with 'ul':
+    #   <p class="ul">ZUCCHINI BLOSSOMS <strong>(See also Zucchini)</strong></p>
+    elif T[0].isupper() and ptag.strong_lead:
+        state.flag = 0
+        state.title = S[0].strip()
+        bible[state.title] = {state.title.lower():state.flag}
+        bible[state.title][ptag.strongs[0]] = 1
+        return
+
+    title = state.title
+
+    ##
+    # METADATA
+    ##  capture affinities as raw list for each titular ingredient dictionary
+
+    if contains_affinity(ptag.text):
+        # will be useful for training the flavor model
+        state.dummy_array.append(ptag.text) 
+        bible[title]['affinities'] = state.dummy_array
+        return
+
+    # rule for non-unanimous consensus of flavor nemeses
+    if state.flag == 1:
+        qual = "say some"
+        if qual in ptag.text:
+            bible[title][remove_parens(ptag.text)] = -state.flag/2.
+        else: 
+            bible[title][remove_parens(ptag.text)] = -state.flag/1.
+        return
+    if contains_avoid(ptag.text):
+        state.flag = 1
+        return
+
+    # topical subtext for the source ingredient
+    if contains_topics(topics, ptag.text):
+        topic, matter = contains_topics(topics, ptag.text)
+        # now to address [errata]:
+        if topic == "Use ":
+            matter = topic+matter
+            topic = "Tips:"
+        state.dummy_dict.update( {topic.replace(':',''):matter} )
+        bible[title]['topics'] = state.dummy_dict
+        return
+
+    # when: a: x (peak Y)
+    if re.search('peak ', ptag.text) or re.search('peak: ', ptag.text):
+        entry = ptag.text.lower()
+        entry = remove_parens(entry)
+        # print("contains peak", entry, what_rank(ptag))
+        bible[title][entry]=what_rank(ptag)
+        return
+    # TODO: Keep this data, then parse out in pandas code, but store as a range
+    # here because it might be nice to query "October" for the graph, or maybe 
+    # it's better to just use a third party seasonal ingredient database that has
+    # ag-zone boundaries, since that's how you'd use it. You only see this 
+    # heuristic in the book under each of the four seasons.
+
+    ##
+    # TARGETS
+    ##            
+
+    # when: a: x, y, z, [..,]
+    # e.g.:
+    #
+    #   <p class="ul">
+    #       <strong>CHEESE: BLUE, Brie, Cabrales,</strong> 
+    #       Cambozola, Camembert, Cantal, cheddar, feta, 
+    #       <strong>goat, Gorgonzola,</strong> 
+    #       Monterey Jack, 
+    #       <strong>Parmesan, pecorino,</strong> 
+    #       ricotta, Romano, 
+    #       <strong>ROQUEFORT, Stilton</strong>
+    #   </p>
+    #
+
+    # [errata]
+    if "When look" in ptag.text: return
+    # [/errata]    
+
+    if re.search(':', ptag.text):
+        # this case is much different, because what proceeds the
+        # colon ':' is a category (genre) that might either be
+        # read after or before or need not be mentioned with the 
+        # following matter after the colon (species).  Therefore,
+        # in order for the database to reflect natural language, 
+        # we must accurately provide the context for that species
+        # as close to English as we can.. 
+
+        #if title == 'PEARS': #continue #!Debug
+        #    print(ptag)
+        subtitle = ptag.text.split(':')[0]
+        subtext = ptag.text.split(':')[1]
+
+        # when: a: x (e.g., y), z
+        if "(e.g." in subtext:
+            Y = pb.parse_brackets(subtext, r'\(e.g.', r'\)', sep=',', nest=r'\(')
+        else:
+            Y = ptag.text.split(':')[1].strip()
+            Y = Y.split(',')
+        
 
-            # topical subtext for the source ingredient
-            if contains_topics(topics, ptag.text):
-                topic, matter = contains_topics(topics, ptag.text)
-                # now to address [errata]:
-                if topic == "Use ":
-                    matter = topic+matter
-                    topic = "Tips:"
-                dummy_dict.update( {topic.replace(':',''):matter} )
-                bible[title]['topics'] = dummy_dict
-                continue
+        Y = isCulinaryGroup.orient(ptag.text, subtitle, Y)
+        Y, y = rank_subtags(Y, ptag, genre=subtitle)
+        for i in range(len(Y)):
+            subtitle = Y[i].lower().strip('*').strip()
+            bible[title][subtitle] = y[i]
+
+    # when: a (e.g., x, y, [,..])
+    elif "(e.g." in ptag.text:
+        X = ptag.text
+        # [errata: pp. 334]
+        if ")" not in X:
+            X+=")"
+        # [/errata]
+        Y = pb.parse_brackets(X, r'\(e.g.', r'\)', sep=',', nest=r'\(')
+        # [errata pp 151]
+        if 'sweet (' in ptag.text:
+            Y = [re.sub(r'sweet \(','', y) for y in Y]
+            Y = [re.sub(r'\)','', y) for y in Y]
+        # [/errata]
+        Y, y = rank_subtags(Y, ptag)
+        for i in range(len(Y)):
+            subtitle = Y[i].lower().strip('*').strip()
+            bible[title][subtitle] = y[i]
+
+    # when: a, b [hopefully]
+    else:
+        if re.search(',', ptag.text):
+            X = re.sub('esp. ','',ptag.text)
+            X = re.sub('e.g.,','',X)
+            X = re.sub(' or ','', X) 
+            Y = X.split(',')
+            genre = Y[0]
+
+            Y = isCulinaryGroup.orient(X, genre, Y[1:])
+            Y, y = rank_subtags(Y, ptag, genre=genre)
+            for i in range(len(Y)):
+                subtitle = Y[i].lower().strip('*').strip()
+                bible[title][subtitle] = y[i]
+
+        # finally, store the ingredients
+        subtitle, rank = ptag.text.lower(), what_rank(ptag)
+        bible[title][subtitle] = rank
+
+def parse_chapter(source):
+    """Parse a single chapter, given its path or an open file
+
+    Returns the chapter's bible, the state after its last paragraph, and
+    any paragraphs ahead of its first title.  Those still
+    belong to the previous chapter's last ingredient, so merge_chapters
+    replays them instead.  A title paragraph that names no ingredient,
+    like a lone "walnut oil (See Oil, Walnut)", is one of them too.
+    """
+    bible = {}
+    state = None
+    leading = []
+    for ptag in read_paragraphs(source):
+        if state is None:
+            if is_title(ptag):
+                state = parseState()
+                parse_ptag(bible, state, ptag)
+                if state.title is not None:
+                    continue
+                state = None
+            leading.append(ptag)
+            continue
+        parse_ptag(bible, state, ptag)
+    return bible, state, leading
+
+def merge_chapters(chapters):
+    """Merge parsed chapters, in order, as if parsed in one pass"""
+    bible = {}
+    state = parseState()
+    for chapter, chapter_state, leading in chapters:
+        for ptag in leading:
+            parse_ptag(bible, state, ptag)
+        # keys already seen keep their place, like reassigning them would
+        bible.update(chapter)
+        if chapter_state is not None:
+            state = chapter_state
+    return bible
 
-            # when: a: x (peak Y)
-            if re.search('peak ', ptag.text) or re.search('peak: ', ptag.text):
-                entry = ptag.text.lower()
-                entry = remove_parens(entry)
-                # print("contains peak", entry, what_rank(ptag))
-                bible[title][entry]=what_rank(ptag)
+##
+# Parse cache
+##  a chapter only needs parsing again when its file or the rules change
+
+def rules_fingerprint():
+    """Fingerprint of the rules chapters are parsed with
+
+    The topics and errata rules live in this file and the orient tables in
+    genres.json, so hash those whole, along with the code that uses them.
+    """
+    fingerprint = hashlib.sha256()
+    for module in (__file__, pb.__file__, src.utils.genres.__file__,
+                   src.utils.genres.rules_file, src.utils.paragraphs.__file__):
+        with open(module, 'rb') as f:
+            fingerprint.update(f.read())
+    return fingerprint.hexdigest()
+
+def chapter_key(input_file, fingerprint):
+    with open(input_file, 'rb') as f:
+        return hashlib.sha256(f.read() + fingerprint.encode()).hexdigest()
+
+def chapter_cache(cache_dir, input_file):
+    """The cache of the chapter's book: one subdirectory per input directory"""
+    book = os.path.dirname(os.path.abspath(input_file))
+    return os.path.join(cache_dir, hashlib.sha256(book.encode()).hexdigest()[:16])
+
+def load_cached(cache_dir, key):
+    cache_file = os.path.join(cache_dir, key + '.pickle')
+    if not os.path.isfile(cache_file):
+        return None
+    with open(cache_file, 'rb') as f:
+        return pickle.load(f)
+
+def store_cached(cache_dir, key, chapter):
+    # pickle keeps the topics and affinities shared between titles, which
+    # the next chapter's leading paragraphs may still update
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file = os.path.join(cache_dir, key + '.pickle')
+    with open(cache_file + '.tmp', 'wb') as f:
+        pickle.dump(chapter, f)
+    os.replace(cache_file + '.tmp', cache_file)
+
+def prune_cache(cache_dir, keys):
+    """Remove cached chapters of this book that this run didn't use
+
+    Other books' caches are left alone, so switching between input
+    directories doesn't parse either one again.
+    """
+    for cache_file in glob.glob(os.path.join(cache_dir, '*.pickle')):
+        if os.path.basename(cache_file)[:-len('.pickle')] not in keys:
+            os.remove(cache_file)
+
+def parse_chapters(input_files, jobs=1, cache_dir=None):
+    """Parse chapters into the bible, in parallel when jobs > 1
+
+    With a cache_dir, chapters whose file and parse rules haven't changed
+    since the last run are loaded from there instead of parsed.  Open
+    files are parsed too, but only in this process and never cached.
+    """
+    input_files = list(input_files)
+    if any(hasattr(input_file, 'read') for input_file in input_files):
+        jobs, cache_dir = 1, None
+    chapters = [None] * len(input_files)
+    keys, books = [], []
+    if cache_dir:
+        fingerprint = rules_fingerprint()
+        for i, input_file in enumerate(input_files):
+            keys.append(chapter_key(input_file, fingerprint))
+            books.append(chapter_cache(cache_dir, input_file))
+            chapters[i] = load_cached(books[i], keys[i])
+
+    todo = [i for i in range(len(input_files)) if chapters[i] is None]
+    todo_files = [input_files[i] for i in todo]
+    if jobs > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            parsed = list(executor.map(parse_chapter, todo_files))
+    else:
+        parsed = map(parse_chapter, todo_files)
+    for i, chapter in zip(todo, parsed):
+        chapters[i] = chapter
+        if cache_dir:
+            store_cached(books[i], keys[i], chapter)
+
+    if cache_dir:
+        for book in set(books):
+            prune_cache(book, {key for key, b in zip(keys, books) if b == book})
+        print('Parsed {} of {} chapters, the rest were cached'.format(
+            len(todo), len(input_files)))
+    return merge_chapters(chapters)
+
+def iter_ingredients(sources):
+    """Yield (title, entries) for each source ingredient as it is finished
+
+    An ingredient is finished once the next .lh/.lh1 title starts one;
+    until then later paragraphs may still add to it, or to the topics and
+    affinities it shares with titles caught by the errata rules.  A title
+    that comes up again is yielded again, and as in the bible, the last
+    entries win, so dict(iter_ingredients(sources)) is the bible.
+    """
+    state = parseState()
+    ingredients = {}
+    for source in sources:
+        for ptag in read_paragraphs(source):
+            if not is_title(ptag):
+                parse_ptag(ingredients, state, ptag)
                 continue
-            # TODO: Keep this data, then parse out in pandas code, but store as a range
-            # here because it might be nice to query "October" for the graph, or maybe 
-            # it's better to just use a third party seasonal ingredient database that has
-            # ag-zone boundaries, since that's how you'd use it. You only see this 
-            # heuristic in the book under each of the four seasons.
-
-            ##
-            # TARGETS
-            ##            
-   
-            # when: a: x, y, z, [..,]
-            # e.g.:
-            #
-            #   <p class="ul">
-            #       <strong>CHEESE: BLUE, Brie, Cabrales,</strong> 
-            #       Cambozola, Camembert, Cantal, cheddar, feta, 
-            #       <strong>goat, Gorgonzola,</strong> 
-            #       Monterey Jack, 
-            #       <strong>Parmesan, pecorino,</strong> 
-            #       ricotta, Romano, 
-            #       <strong>ROQUEFORT, Stilton</strong>
-            #   </p>
-            #
-
-            # [errata]
-            if "When look" in ptag.text: continue
-            # [/errata]    
-
-            if re.search(':', ptag.text):
-                # this case is much different, because what proceeds the
-                # colon ':' is a category (genre) that might either be
-                # read after or before or need not be mentioned with the 
-                # following matter after the colon (species).  Therefore,
-                # in order for the database to reflect natural language, 
-                # we must accurately provide the context for that species
-                # as close to English as we can.. 
-
-                #if title == 'PEARS': #continue #!Debug
-                #    print(ptag)
-                def rank(x): return 4 - x
-                subtitle = ptag.text.split(':')[0]
-                subtext = ptag.text.split(':')[1]
-                s_tags = ptag.find_all('strong')
-        
-                # when: a: x (e.g., y), z
-                if "(e.g." in subtext:
-                    Y = pb.parse_brackets(subtext, r'\(e.g.', r'\)', sep=',')
-                else:
-                    Y = ptag.text.split(':')[1].strip()
-                    Y = Y.split(',')
-                
-
-                Y = isCulinaryGroup.orient(ptag.text, subtitle, Y)
-                Y, y = rank_subtags(Y, ptag)
-                for i in range(len(Y)):
-                    subtitle = Y[i].lower().strip('*').strip()
-                    bible[title][subtitle] = y[i]
-
-            # when: a (e.g., x, y, [,..])
-            elif "(e.g." in ptag.text:
-                X = ptag.text
-                # [errata: pp. 334]
-                if ")" not in X:
-                    X+=")"
-                # [/errata]
-                Y = pb.parse_brackets(X, r'\(e.g.', r'\)', sep=',')
-                # [errata pp 151]
-                if 'sweet (' in ptag.text:
-                    Y = [re.sub(r'sweet \(','', y) for y in Y]
-                    Y = [re.sub(r'\)','', y) for y in Y]
-                # [/errata]
-                Y, y = rank_subtags(Y, ptag)
-                for i in range(len(Y)):
-                    subtitle = Y[i].lower().strip('*').strip()
-                    bible[title][subtitle] = y[i]
-
-            # when: a, b [hopefully]
-            else:
-                if re.search(',', ptag.text):
-                    def rank(x): return 4 - x
-                    X = re.sub('esp. ','',ptag.text)
-                    X = re.sub('e.g.,','',X)
-                    X = re.sub(' or ','', X) 
-                    Y = X.split(',')
-                    s_tags = ptag.find_all('strong')
-
-            
-                    Y = isCulinaryGroup.orient(X, Y[0], Y[1:])
-                    Y, y = rank_subtags(Y, ptag)
-                    for i in range(len(Y)):
-                        subtitle = Y[i].lower().strip('*').strip()
-                        bible[title][subtitle] = y[i]
-
-                # finally, store the ingredients
-                subtitle, rank = ptag.text.lower(), what_rank(ptag)
-                bible[title][subtitle] = what_rank(ptag)
-
-
-output_file = open("data/bible.json", "w")
-json.dump(bible, output_file, indent = 2)
+            # a title naming no ingredient leaves the current one open
+            started = {}
+            parse_ptag(started, state, ptag)
+            if started:
+                yield from ingredients.items()
+                ingredients = started
+    yield from ingredients.items()
+
+def main():
+    args = docopt(__doc__)
+    if args['--ndjson']:
+        with open("data/bible.ndjson", "w") as output_file:
+            write_records(output_file, iter_ingredients(chapter_files()))
+        return
+
+    jobs = int(args['--jobs'])
+    cache_dir = None if args['--no-cache'] else args['--cache']
+
+    # in the beginning..
+    bible = parse_chapters(chapter_files(), jobs=jobs, cache_dir=cache_dir)
+
+    with open("data/bible.json", "w") as output_file:
+        json.dump(bible, output_file, indent = 2)
+
+if __name__ == '__main__':
+    main()
 
 # TODO: what to do about reference pointers?
 # TODO: account for ", esp. [..] or [..]" cases
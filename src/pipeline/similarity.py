@@ -1,12 +1,69 @@
 """
 Usage:
-    similarity.py -i input_json_file -o output_json_file
+    similarity.py -i input_json_file -o output_json_file [--engine=<engine>] [--metric=<metric>]
+                  [--top-k=<n>] [--min-sim=<x>] [--store=<dir> | --no-store]
+                  [--perms=<n>] [--bands=<n>] [--recall] [--jobs=<n>] [--memory=<mb>]
+                  [--incremental] [--metrics=<list>]
+    similarity.py --benchmark [--report=<file>] [--sizes=<list>] [--densities=<list>]
 
 Options:
     -i input_json_file     The input json file, which is the output of
-                            clean.py
+                            clean.py (or its .ndjson, or its .matrix/
+                            directory)
     -o output_json_file    The output json file, which is the output of
                             this script
+    --engine=<engine>      'sparse' computes the jaccard straight from the
+                            sparse weights, 'dense' through a DataFrame
+                            and sklearn, 'lsh' approximates it, see below
+                            [default: sparse]
+    --metric=<metric>      'jaccard', or 'jaccard_probability' to weigh
+                            entries by rank (sparse engine only, see notes);
+                            the dense engine takes any sklearn metric
+                            [default: jaccard]
+    --top-k=<n>            Only write each ingredient's n most similar
+                            ingredients (itself included)
+    --min-sim=<x>          Only write similarities of at least x
+    --store=<dir>          Where to write the binary similarity store, by
+                            default next to the output, e.g.
+                            data/similarity.store/ for data/similarity.json
+    --no-store             Don't write the binary similarity store
+    --perms=<n>            MinHash permutations for --engine=lsh [default: 128]
+    --bands=<n>            LSH bands the permutations are split into; it
+                            must divide --perms [default: 32]
+    --recall               With --engine=lsh, also run the exact engine and
+                            report the share of similar pairs found
+    --jobs=<n>             Compute the sparse engine's rows in blocks, on n
+                            worker processes, writing each block as it is
+                            done
+    --memory=<mb>          Roughly the most memory the blocks may take, in
+                            MB; implies blocks, on one process unless --jobs
+                            is given; 1024 if only --jobs is
+    --incremental          Only recompute the ingredients whose entries
+                            changed since the run that wrote the store, patch
+                            the store, and rewrite the output from it
+    --metrics=<list>       Several of jaccard, cosine and hamming, comma
+                            separated, computed in one pass and written to
+                            one output keyed by metric (and no store)
+    --benchmark            Check every engine against a reference on random
+                            ingredient matrices, and time it
+    --report=<file>        Where to write the benchmark report, as json
+                            [default: data/similarity-benchmark.json]
+    --sizes=<list>         Ingredients in each random matrix, comma
+                            separated [default: 100,400,1600]
+    --densities=<list>     Share of nonzero weights, comma separated
+                            [default: 0.01,0.05]
+
+With --engine=lsh, only pairs of ingredients that agree on all the MinHash
+rows of at least one band are compared, exactly, and the rest are taken as
+0.  Pairs of similarity above about (1/bands)^(bands/perms) are likely to
+be found; --recall measures how many (of those of at least --min-sim, if
+given) were.
+
+The store always holds every similarity (see src/utils/store.py), and
+tools/heatmap.py and tools/visualize.py can read it instead of the json.
+
+With --top-k or --min-sim, similarities of 0 are left out too; readers
+should take a missing pair as 0.
 
 The input json file should the file that was output by
 the clean.py script, whereas the output json file 
@@ -20,9 +77,18 @@ import numpy as np
 import os.path
 import json
 import sys
+import time
+import tracemalloc
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from scipy import sparse
 from sklearn.metrics.pairwise import pairwise_distances
 
 from docopt import docopt
+from src.utils.matrix import matrixBuilder, load_matrix, save_matrix
+from src.utils.ndjson import is_ndjson, iter_records
+from src.utils.store import (is_store, read_meta, scale, similarityStore, storeWriter,
+                             write_meta, write_store)
 
 def set_from_df_col(df, col):
     # get the set of non-zero entries
@@ -60,7 +126,260 @@ def similarity_from_metric(df, metric):
     sim_matrix = pd.DataFrame(sim_matrix, index=df.columns, columns=df.columns)
 
     return sim_matrix
-        
+
+##
+# Sparse engine
+##  the clean data is overwhelmingly zero, so the jaccard is computed from
+#   a boolean sparse matrix: intersections are a sparse matrix product,
+#   and unions follow from the number of entries of each ingredient.
+
+def load_inputs(input_file):
+    """The vocabulary, source ids and weights, as load_matrix returns them"""
+    if os.path.isdir(input_file):
+        return load_matrix(input_file)
+    matrix = matrixBuilder()
+    if is_ndjson(input_file):
+        records = iter_records(input_file)
+    else:
+        with open(input_file) as f:
+            records = json.load(f).items()
+    for key, entries in records:
+        matrix.add(key, entries)
+    return matrix.build()
+
+def load_weights(input_file):
+    """The source ingredients, and their weights as a sparse matrix
+
+    Rows are the source ingredients, in sorted order like the columns of
+    pd.read_json, and columns every name in the vocabulary.
+    """
+    names, sources, weights = load_inputs(input_file)
+    return [names[i] for i in sources], weights[sources]
+
+def to_boolean(weights):
+    """1 for each nonzero weight, like sklearn does for boolean metrics"""
+    incidence = sparse.csr_matrix(weights, dtype=np.float64, copy=True)
+    incidence.eliminate_zeros()
+    incidence.data[:] = 1
+    return incidence
+
+def sparse_jaccard(weights):
+    """Jaccard similarity between the rows, as a sparse matrix
+
+    Pairs with nothing in common are left out (they are 0), except pairs
+    of empty rows, which are 1 as in scipy.
+    """
+    incidence = to_boolean(weights)
+    sizes = np.diff(incidence.indptr)
+    sim = (incidence @ incidence.T).tocoo()
+    union = sizes[sim.row] + sizes[sim.col] - sim.data
+    # 1 - distance, the same sum as scipy's, so they round alike
+    sim.data = 1 - (union - sim.data) / union
+    sim = sim.tocsr()
+    empty = np.flatnonzero(sizes == 0)
+    if len(empty):
+        rows, cols = np.meshgrid(empty, empty)
+        ones = sparse.csr_matrix((np.ones(rows.size), (rows.ravel(), cols.ravel())),
+                                 shape=sim.shape)
+        sim = sim + ones
+    return sim
+
+def row_triples(weights, degree):
+    """The running count of (row, row, entry) triples, up to each row"""
+    return np.cumsum(to_boolean(weights) @ degree)
+
+def chunk_rows(triples, budget, start=0, stop=None):
+    """Split rows start:stop into ranges of about budget triples, given row_triples"""
+    stop = len(triples) if stop is None else stop
+    done = triples[start - 1] if start else 0
+    while start < stop:
+        end = min(max(int(np.searchsorted(triples, done + budget, side='right')), start + 1), stop)
+        yield start, end
+        done = triples[end - 1]
+        start = end
+
+def iter_row_chunks(weights, degree, budget):
+    """Split the rows into ranges of about budget (row, row, entry) triples"""
+    return chunk_rows(row_triples(weights, degree), budget)
+
+def probability_inputs(weights):
+    """The weights as probability_rows takes them"""
+    weights = sparse.csr_matrix(weights, dtype=np.float64, copy=True)
+    weights.eliminate_zeros()
+    weights.sort_indices()
+    columns = weights.tocsc()
+    totals = np.asarray(weights.sum(axis=1)).ravel()
+    return weights, columns, totals, np.diff(columns.indptr)
+
+def probability_rows(weights, columns, totals, degree, start, stop):
+    """Rows start:stop of sparse_jaccard_probability, as a sparse matrix
+
+    Takes the weights as returned by probability_inputs.
+    """
+    n = weights.shape[0]
+    # every (a, b, entry) with a in the chunk and entry common to both
+    lo, hi = weights.indptr[start], weights.indptr[stop]
+    entry = weights.indices[lo:hi]
+    x = weights.data[lo:hi]
+    a = np.repeat(np.arange(start, stop), np.diff(weights.indptr[start:stop + 1]))
+    counts = degree[entry]
+    offsets = np.cumsum(counts) - counts
+    at = (np.repeat(columns.indptr[entry], counts) +
+          np.arange(counts.sum()) - np.repeat(offsets, counts))
+    a, x = np.repeat(a, counts), np.repeat(x, counts)
+    b, y = columns.indices[at], columns.data[at]
+    if not len(b):
+        return sparse.csr_matrix((stop - start, n))
+
+    # sort each pair's common entries by x/y
+    pair = (a - start).astype(np.int64) * n + b
+    order = np.lexsort((x / y, pair))
+    pair, a, b, x, y = pair[order], a[order], b[order], x[order], y[order]
+    starts = np.flatnonzero(np.r_[True, pair[1:] != pair[:-1]])
+    sizes = np.diff(np.r_[starts, len(pair)])
+
+    # x of the entries before each one in its pair, y of those from it on
+    cx, cy = np.cumsum(x), np.cumsum(y)
+    before_x = cx - x - np.repeat((cx - x)[starts], sizes)
+    before_y = cy - y - np.repeat((cy - y)[starts], sizes)
+    from_y = np.repeat(np.add.reduceat(y, starts), sizes) - before_y
+    den = totals[a] / x + totals[b] / y - before_x / x - from_y / y
+
+    sim = np.add.reduceat(1 / den, starts)
+    return sparse.csr_matrix((sim, (a[starts] - start, b[starts])), shape=(stop - start, n))
+
+def sparse_jaccard_probability(weights, budget=1 << 22):
+    """Weighted probability jaccard between the rows, as a sparse matrix
+
+    The same measure as tools/jaccard_probability_measure.py: for rows x
+    and y, the sum over their common entries i of
+
+        1 / sum_j max(x_j/x_i, y_j/y_i)
+
+    The sum over j is sum(x)/x_i + sum(y)/y_i - sum_j min(x_j/x_i, y_j/y_i),
+    and the min only involves common entries: x_j/x_i where x_j/y_j is
+    below x_i/y_i, y_j/y_i otherwise.  So once the common entries of a pair
+    are sorted by x/y, every term follows from running sums.
+
+    Rows are done a chunk at a time, about budget common entries each.
+    """
+    weights, columns, totals, degree = probability_inputs(weights)
+    n = weights.shape[0]
+    blocks = [probability_rows(weights, columns, totals, degree, start, stop)
+              for start, stop in iter_row_chunks(weights, degree, budget)]
+    if not blocks:
+        return sparse.csr_matrix((n, n))
+    return sparse.vstack(blocks, format='csr')
+
+##
+# Approximate engine
+##  MinHash signatures of each ingredient's entries, and locality-sensitive
+#   hashing (LSH) on bands of them to pick the pairs worth comparing, so
+#   the work grows with the number of similar pairs rather than n^2.
+
+prime = (1 << 31) - 1
+
+def minhash_signatures(incidence, perms=128, seed=0, chunk=1 << 20):
+    """MinHash signature of each row, perms x uint32 per row
+
+    Each permutation is a universal hash (a*x + b) mod prime of the column
+    ids; a row's value is the least over its entries.  Empty rows are left
+    at prime.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, prime, size=perms, dtype=np.int64)
+    b = rng.integers(0, prime, size=perms, dtype=np.int64)
+    n = incidence.shape[0]
+    signatures = np.full((n, perms), prime, dtype=np.int64)
+    sizes = np.diff(incidence.indptr)
+    rows = np.flatnonzero(sizes)
+    # whole rows at a time, about chunk entries each
+    total = np.cumsum(sizes[rows])
+    start = 0
+    while start < len(rows):
+        done = total[start - 1] if start else 0
+        stop = max(int(np.searchsorted(total, done + chunk, side='right')), start + 1)
+        block = rows[start:stop]
+        lo, hi = incidence.indptr[block[0]], incidence.indptr[block[-1] + 1]
+        columns = incidence.indices[lo:hi].astype(np.int64)
+        hashes = (columns[:, None] * a + b) % prime
+        signatures[block] = np.minimum.reduceat(hashes, incidence.indptr[block] - lo, axis=0)
+        start = stop
+    return signatures.astype(np.uint32)
+
+def lsh_candidates(signatures, bands=32):
+    """Pairs (i < j) of rows whose signatures agree on some band"""
+    n, perms = signatures.shape
+    width = perms // bands
+    empty = signatures[:, 0] == prime
+    multipliers = np.random.default_rng(1).integers(1, 1 << 63, size=width, dtype=np.uint64)
+    pairs = []
+    for band in range(bands):
+        rows = signatures[:, band * width:(band + 1) * width].astype(np.uint64)
+        keys = (rows * multipliers).sum(axis=1)
+        keys[empty] = np.arange(empty.sum(), dtype=np.uint64)  # never in a bucket
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        sizes = np.diff(np.r_[starts, n])
+        # every member of a bucket, paired with the members after it
+        at = np.repeat(sizes > 1, sizes)
+        position = np.arange(n)[at]
+        end = np.repeat(starts + sizes, sizes)[at]
+        counts = end - position - 1
+        left = np.repeat(position, counts)
+        right = left + 1 + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        i, j = order[left], order[right]
+        pairs.append(np.minimum(i, j).astype(np.int64) * n + np.maximum(i, j))
+    pairs = np.unique(np.concatenate(pairs)) if pairs else np.empty(0, dtype=np.int64)
+    return pairs // n, pairs % n
+
+def lsh_jaccard(weights, perms=128, bands=32, chunk=1 << 20):
+    """Jaccard similarity of the LSH candidate pairs, as a sparse matrix
+
+    Like sparse_jaccard, but pairs that were never candidates are 0.
+    """
+    incidence = to_boolean(weights)
+    n = incidence.shape[0]
+    sizes = np.diff(incidence.indptr)
+    i, j = lsh_candidates(minhash_signatures(incidence, perms), bands)
+    values = np.empty(len(i))
+    for start in range(0, len(i), chunk):
+        a, b = i[start:start + chunk], j[start:start + chunk]
+        common = np.asarray(incidence[a].multiply(incidence[b]).sum(axis=1)).ravel()
+        union = sizes[a] + sizes[b] - common
+        values[start:start + chunk] = 1 - (union - common) / union
+    found = values > 0
+    i, j, values = i[found], j[found], values[found]
+    diagonal = np.arange(n)
+    return sparse.csr_matrix((np.r_[values, values, np.ones(n)],
+                              (np.r_[i, j, diagonal], np.r_[j, i, diagonal])), shape=(n, n))
+
+def lsh_recall(weights, approx, min_sim):
+    """Share of the pairs of exact similarity >= min_sim that approx found
+
+    Pairs of empty rows, which are 1 by convention, don't count.
+    """
+    exact = sparse.triu(sparse_jaccard(weights), k=1).tocoo()
+    sizes = np.diff(to_boolean(weights).indptr)
+    similar = (exact.data >= min_sim) & (sizes[exact.row] > 0)
+    rows, cols = exact.row[similar], exact.col[similar]
+    n = approx.shape[0]
+    approx = approx.tocoo()
+    found = np.isin(rows.astype(np.int64) * n + cols,
+                    approx.row.astype(np.int64) * n + approx.col)
+    return int(found.sum()), len(rows)
+
+sparse_metrics = {
+    'jaccard': sparse_jaccard,
+    'jaccard_probability': sparse_jaccard_probability,
+}
+
+def sparse_similarity(input_file, metric='jaccard'):
+    """The similarity of the clean data, as a sparse matrix"""
+    sources, weights = load_weights(input_file)
+    return sources, sparse_metrics[metric](weights)
+
 def sort_by_similarity(df):
     # input: a dataframe
     # output: a json file 
@@ -86,55 +405,524 @@ def sort_by_similarity(df):
 
     return sorted_dict
 
-# this is the test function
-def test():
-    """Usage: test()"""
+def top_k_rows(block, names, k=None, min_sim=None):
+    """Each row's top k and/or those of at least min_sim, and no zeros
+
+    block is a dense block of rows, already rounded to 3 places; the rows
+    are selected with np.partition instead of being sorted whole, and ties
+    are broken by column, as in the full sort.
+    """
+    n = block.shape[1]
+    k = n if k is None else min(k, n)
+    # the kth largest of each row, anything below can't make it
+    kth = -np.partition(-block, k - 1, axis=1)[:, k - 1]
+    keep = (block >= kth[:, None]) & (block > 0)
+    if min_sim is not None:
+        keep &= block >= min_sim
+    rows, cols = np.nonzero(keep)
+    values = block[rows, cols]
+    order = np.lexsort((cols, -values, rows))
+    rows, cols, values = rows[order], cols[order], values[order]
+    top = [{} for row in range(block.shape[0])]
+    for row, col, value in zip(rows.tolist(), cols.tolist(), values.tolist()):
+        if len(top[row]) < k:
+            top[row][names[col]] = value
+    return top
+
+def sorted_rows(block, names):
+    """Each row of a rounded dense block, sorted as in sort_by_similarity"""
+    order = np.argsort(-block, axis=1, kind='stable')
+    values = np.take_along_axis(block, order, axis=1)
+    return [dict(zip([names[col] for col in cols], row))
+            for cols, row in zip(order.tolist(), values.tolist())]
+
+def top_k_by_similarity(sim, names, k=None, min_sim=None, chunk=1024):
+    """Like sort_by_similarity, but only each row's top k and/or those of
+    at least min_sim, and no zeros
+
+    sim is a dense or sparse square matrix, rounded to 3 places here, a
+    chunk of rows at a time.
+    """
+    top = {}
+    for start in range(0, sim.shape[0], chunk):
+        block = sim[start:start + chunk]
+        block = block.toarray() if sparse.issparse(block) else np.asarray(block)
+        for row, neighbours in enumerate(top_k_rows(block.round(3), names, k, min_sim)):
+            top[names[start + row]] = neighbours
+    return top
+
+def write_json_rows(f, rows, depth=0):
+    """Write (name, neighbours) rows as one json object, as they come
+
+    Laid out like json.dump(..., indent=2) of the whole dict, or of the
+    dict it is a value of, depth levels down.
+    """
+    pad = '\n' + '  ' * (depth + 1)
+    f.write('{')
+    separator = pad
+    for name, neighbours in rows:
+        f.write(separator + json.dumps(name) + ': ' +
+                json.dumps(neighbours, indent=2).replace('\n', pad))
+        separator = ',' + pad
+    f.write('}' if separator == pad else pad[:-2] + '}')
+
+##
+# Blocked engine
+##  rows are computed a block at a time, on a pool of processes, and each
+#   block is written out as soon as it is done, so memory is set by the
+#   block size rather than by n^2.
+
+block_state = {}
 
-    # use this preformatted sparse matrix
-    print('using preformatted sparse matrix')
-    df = pd.DataFrame(np.random.binomial(1, 0.2, size=(100, 5)), columns=list('ABCDE'))
-    print(df.head(5).tail(3))
+def init_block_worker(input_file, metric, budget=1 << 22):
+    _, weights = load_weights(input_file)
+    block_state['metric'] = metric
+    if metric == 'jaccard':
+        incidence = to_boolean(weights)
+        block_state['inputs'] = (incidence, incidence.T.tocsr(), np.diff(incidence.indptr))
+    else:
+        inputs = probability_inputs(weights)
+        block_state['inputs'] = inputs
+        block_state['triples'] = row_triples(inputs[0], inputs[3])
+        block_state['budget'] = budget
+
+def jaccard_from_counts(common, row_sizes, sizes):
+    """Jaccard of a dense block of intersection counts, from the sizes of
+    its rows and of all rows"""
+    union = row_sizes[:, None] + sizes[None, :] - common
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sim = 1 - (union - common) / union
+    sim[union == 0] = 1
+    return sim
+
+def jaccard_rows(incidence, transposed, sizes, rows):
+    """Some rows (a slice or ids) of sparse_jaccard, dense"""
+    common = (incidence[rows] @ transposed).toarray()
+    return jaccard_from_counts(common, sizes[rows], sizes)
+
+def compute_block(bounds):
+    start, stop = bounds
+    if block_state['metric'] == 'jaccard':
+        return jaccard_rows(*block_state['inputs'], slice(start, stop))
+    # a chunk of the block's rows at a time, so the triples stay in budget
+    inputs = block_state['inputs']
+    block = np.zeros((stop - start, inputs[0].shape[0]))
+    for a, b in chunk_rows(block_state['triples'], block_state['budget'], start, stop):
+        sim = probability_rows(*inputs, a, b).tocoo()
+        block[sim.row + (a - start), sim.col] = sim.data
+    return block
+
+# bytes probability_rows takes per (row, row, entry) triple, at its peak
+triple_bytes = 128
+
+def block_rows(n, jobs, memory, metric='jaccard'):
+    """Rows per block, and triples per chunk of a block, to stay within memory bytes
 
-    print('checking metrics...')
+    Each block is about six n-wide float64 copies while it is computed and
+    written, and up to 2 * jobs blocks are held at a time.  For
+    jaccard_probability, each worker also holds a chunk's triples; half of
+    memory goes to those.
+    """
+    if metric == 'jaccard':
+        return max(1, int(memory // (n * 8 * 6 * 2 * jobs))), None
+    rows = max(1, int(memory / 2 // (n * 8 * 6 * 2 * jobs)))
+    return rows, max(1, int(memory / 2 / jobs // triple_bytes))
+
+def iter_blocks(input_file, metric, n, jobs=1, rows=1024, budget=1 << 22):
+    """Yield (start, block) for each block of rows, in order"""
+    bounds = [(start, min(start + rows, n)) for start in range(0, n, rows)]
+    if jobs == 1:
+        init_block_worker(input_file, metric, budget)
+        for start, stop in bounds:
+            yield start, compute_block((start, stop))
+        return
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_block_worker,
+                             initargs=(input_file, metric, budget)) as executor:
+        pending = deque()
+        for start, stop in bounds:
+            pending.append((start, executor.submit(compute_block, (start, stop))))
+            if len(pending) >= 2 * jobs:
+                start, future = pending.popleft()
+                yield start, future.result()
+        while pending:
+            start, future = pending.popleft()
+            yield start, future.result()
+
+def similarity_rows(weights, rows, metric, budget=1 << 22):
+    """Some rows (ids) of the similarity of the sparse engine, dense"""
+    if metric == 'jaccard':
+        incidence = to_boolean(weights)
+        return jaccard_rows(incidence, incidence.T.tocsr(), np.diff(incidence.indptr), rows)
+    # the rows asked for, on top of all of them, so they are rows 0:len(rows)
+    stacked = probability_inputs(sparse.vstack([weights[rows], weights], format='csr'))
+    head, degree = stacked[0][:len(rows)], stacked[3]
+    block = sparse.vstack([probability_rows(*stacked, start, stop)
+                           for start, stop in iter_row_chunks(head, degree, budget)])
+    return block.tocsr()[:, len(rows):].toarray()
+
+def blocked_similarity(input_file, output_file, metric, jobs, memory,
+                       top_k=None, min_sim=None, store=None):
+    """Compute and write the similarity a block of rows at a time"""
+    sources, weights = load_weights(input_file)
+    n = len(sources)
+    del weights
+    rows, budget = block_rows(n, jobs, memory, metric)
+    writer = storeWriter(store, sources) if store else None
+
+    def iter_rows():
+        for start, block in iter_blocks(input_file, metric, n, jobs, rows, budget or 1 << 22):
+            if writer:
+                writer.write(start, block)
+            block = block.round(3)
+            if top_k or min_sim is not None:
+                neighbours = top_k_rows(block, sources, top_k, min_sim)
+            else:
+                neighbours = sorted_rows(block, sources)
+            yield from zip(sources[start:start + len(block)], neighbours)
+
+    with open(output_file, 'w') as f:
+        write_json_rows(f, iter_rows())
+    if writer:
+        writer.close()
 
-    # test the (metric) jaccard similarity
-    print('jaccard')
-    print(similarity_from_metric(df, 'jaccard'))
+##
+# Incremental
+##  a store keeps the weights it was computed from, so after a small edit
+#   to the clean data only the ingredients whose entries changed (or that
+#   are new) need their rows, and columns, computed again.
 
-    # test the cosine similarity
-    print('cosine')
-    print(similarity_from_metric(df, 'cosine'))
+def record_run(store, input_file, engine, metric):
+    """Keep the inputs and settings of the run that wrote store"""
+    save_matrix(os.path.join(store, 'inputs'), *load_inputs(input_file))
+    write_meta(store, engine=engine, metric=metric)
+
+def source_rows(inputs):
+    """Each source ingredient's entries, as {source: {entry: weight}}"""
+    names, sources, weights = inputs
+    rows = {}
+    for source in sources:
+        lo, hi = weights.indptr[source], weights.indptr[source + 1]
+        rows[names[source]] = dict(zip([names[i] for i in weights.indices[lo:hi]],
+                                       weights.data[lo:hi].tolist()))
+    return rows
+
+def incremental_similarity(input_file, output_file, store, metric, top_k=None, min_sim=None):
+    """Patch the store of a previous run for what changed, then rewrite
+    the output from it; False if there is no run to start from"""
+    meta = read_meta(store) if is_store(store) else {}
+    if meta != {'engine': 'sparse', 'metric': metric}:
+        print('no previous {} run in {}, computing everything'.format(metric, store))
+        return False
+    old_rows = source_rows(load_inputs(os.path.join(store, 'inputs')))
+    new_rows = source_rows(load_inputs(input_file))
+    sources, weights = load_weights(input_file)
+    changed = [i for i, source in enumerate(sources) if old_rows.get(source) != new_rows[source]]
+    print('Recomputing {} of {} ingredients'.format(len(changed), len(sources)))
+
+    old = similarityStore(store)
+    remapped = old.names != sources
+    if remapped:
+        # carry over the pairs of ingredients in both runs, into a new store
+        kept = [i for i, source in enumerate(sources) if source in old.ids]
+        old_ids = np.array([old.ids[sources[i]] for i in kept], dtype=np.int64)
+        kept = np.array(kept, dtype=np.int64)
+        patched = store + '.new'
+        writer = storeWriter(patched, sources)
+        for start in range(0, len(kept), 1024):
+            rows = old.matrix[old_ids[start:start + 1024]][:, old_ids]
+            writer.matrix[np.ix_(kept[start:start + 1024], kept)] = rows
+        matrix = writer.matrix
+    else:
+        matrix = np.load(os.path.join(store, 'similarity.npy'), mmap_mode='r+')
+    for start in range(0, len(changed), 1024):
+        rows = np.array(changed[start:start + 1024])
+        block = np.rint(np.clip(similarity_rows(weights, rows, metric), 0, 1) * scale)
+        matrix[rows] = block
+        matrix[:, rows] = block.T
+    matrix.flush()
+    del matrix, old
+    if remapped:
+        for name in ('names.json', 'similarity.npy'):
+            os.replace(os.path.join(patched, name), os.path.join(store, name))
+        os.rmdir(patched)
+    record_run(store, input_file, 'sparse', metric)
+
+    # the output, from the store
+    result = similarityStore(store)
+    def iter_rows():
+        for start in range(0, len(sources), 1024):
+            block = result.matrix[start:start + 1024] / scale
+            if top_k or min_sim is not None:
+                neighbours = top_k_rows(block, sources, top_k, min_sim)
+            else:
+                neighbours = sorted_rows(block, sources)
+            yield from zip(sources[start:start + len(block)], neighbours)
+    with open(output_file, 'w') as f:
+        write_json_rows(f, iter_rows())
+    return True
+
+##
+# Several metrics at once
+##  jaccard follows from the boolean Gram matrix (the counts of entries
+#   each pair has in common) and the per-row counts; hamming too, with
+#   one Gram matrix per weight for the entries a pair has at the same
+#   weight (the ranks are only 1-4); cosine from the Gram matrix of the
+#   weights, whose diagonal holds the squared norms.  Each product is
+#   computed once, whatever the metrics.
+
+multi_metrics = ('jaccard', 'cosine', 'hamming')
+
+def count_entries(input_file):
+    """How many entries the dense engine compares over
+
+    Those are the entries of any source, whatever their weight; a .matrix
+    keeps nonzero weights only, so there it is the entries of nonzero
+    weight.
+    """
+    if os.path.isdir(input_file):
+        _, sources, weights = load_matrix(input_file)
+        return np.count_nonzero(np.diff(to_boolean(weights[sources]).tocsc().indptr))
+    if is_ndjson(input_file):
+        records = iter_records(input_file)
+    else:
+        with open(input_file) as f:
+            records = json.load(f).items()
+    entries = set()
+    for _, value in records:
+        entries.update(k for k in value if 'topics' not in k and 'affinities' not in k)
+    return len(entries)
 
-    # test the hamming similarity
-    print('hamming')
-    print(similarity_from_metric(df, 'hamming'))
+def gram_intermediates(weights, metrics, features=None):
+    """The products and counts the given metrics are computed from
 
-    # test the simple jaccard similarity
-    print('jaccard - simple')
-    print(jaccard_similarity(df))
+    features is how many entries hamming compares over, by default every
+    column of weights.
+    """
+    incidence = to_boolean(weights)
+    shared = {'sizes': np.diff(incidence.indptr)}
+    if 'jaccard' in metrics or 'hamming' in metrics:
+        shared['common'] = (incidence @ incidence.T).tocsr()
+    if 'hamming' in metrics:
+        weights = sparse.csr_matrix(weights, dtype=np.float64, copy=True)
+        weights.eliminate_zeros()
+        same = sparse.csr_matrix(shared['common'].shape)
+        for value in np.unique(weights.data):
+            level = sparse.csr_matrix(((weights.data == value).astype(np.float64),
+                                       weights.indices, weights.indptr), shape=weights.shape)
+            same = same + level @ level.T
+        shared['same'] = same.tocsr()
+        shared['features'] = weights.shape[1] if features is None else features
+    if 'cosine' in metrics:
+        weights = sparse.csr_matrix(weights, dtype=np.float64)
+        dots = (weights @ weights.T).tocsr()
+        shared['dots'] = dots
+        shared['norms'] = np.sqrt(dots.diagonal())
+    return shared
 
-    # test the set_from_df_col function
-    print('check ing two sets...')
-    print('set_from_df_col')
-    print(set_from_df_col(df, 'A'))
-    print(set_from_df_col(df, 'B'))
+def metric_rows(shared, metric, start, stop):
+    """Rows start:stop of a metric's similarity, dense"""
+    sizes = shared['sizes']
+    if metric == 'jaccard':
+        common = shared['common'][start:stop].toarray()
+        return jaccard_from_counts(common, sizes[start:stop], sizes)
+    if metric == 'hamming':
+        # entries in one of the pair only, and those in both at different
+        # weights
+        common = shared['common'][start:stop].toarray()
+        same = shared['same'][start:stop].toarray()
+        differ = sizes[start:stop, None] + sizes[None, :] - common - same
+        features = shared['features']
+        return 1 - differ / features if features else np.ones(differ.shape)
+    # cosine, as sklearn's: 0 for empty rows, but 1 on the diagonal
+    norms = shared['norms']
+    scales = norms[start:stop, None] * norms[None, :]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sim = np.where(scales > 0, shared['dots'][start:stop].toarray() / scales, 0)
+    sim = 1 - np.clip(1 - sim, 0, 2)
+    rows = np.arange(start, start + len(sim))
+    sim[rows - start, rows] = 1
+    return sim
 
-    # test the simple_jaccard_similarity function
-    print('simple_jaccard_similarity')
-    print(simple_jaccard_similarity(set_from_df_col(df, 'A'), set_from_df_col(df, 'B')))
+def multi_similarity(input_file, output_file, metrics, top_k=None, min_sim=None, chunk=1024):
+    """Write several metrics to one output, {metric: {name: {name: sim}}}"""
+    sources, weights = load_weights(input_file)
+    features = count_entries(input_file) if 'hamming' in metrics else None
+    shared = gram_intermediates(weights, metrics, features)
+
+    def iter_rows(metric):
+        for start in range(0, len(sources), chunk):
+            block = metric_rows(shared, metric, start, start + chunk).round(3)
+            if top_k or min_sim is not None:
+                neighbours = top_k_rows(block, sources, top_k, min_sim)
+            else:
+                neighbours = sorted_rows(block, sources)
+            yield from zip(sources[start:start + chunk], neighbours)
+
+    with open(output_file, 'w') as f:
+        f.write('{')
+        separator = '\n  '
+        for metric in metrics:
+            f.write(separator + json.dumps(metric) + ': ')
+            write_json_rows(f, iter_rows(metric), depth=1)
+            separator = ',\n  '
+        f.write('}' if separator == '\n  ' else '\n}')
+
+##
+# Benchmark
+##  every engine, checked against a reference on synthetic ingredient
+#   matrices, and timed.  Run it before and after a change to the
+#   similarity path and compare the reports.
+
+def synthetic_weights(rows, columns, density, seed=0):
+    """A random sparse ingredient matrix, of ranks 1-4 as clean.apply_weight leaves them"""
+    rng = np.random.default_rng(seed)
+    return sparse.random(rows, columns, density=density, format='csr', random_state=rng,
+                         data_rvs=lambda k: rng.integers(1, 5, k).astype(np.float32))
+
+def as_frame(weights):
+    """The weights laid out like the DataFrame main() reads, ingredients as columns"""
+    return pd.DataFrame(weights.T.toarray())
+
+def dense_blocks(rows_of, n, rows=256):
+    return np.vstack([rows_of(start, min(start + rows, n)) for start in range(0, n, rows)])
+
+def blocked_jaccard(weights):
+    incidence = to_boolean(weights)
+    inputs = (incidence, incidence.T.tocsr(), np.diff(incidence.indptr))
+    return dense_blocks(lambda start, stop: jaccard_rows(*inputs, slice(start, stop)),
+                        weights.shape[0])
+
+def multi_rows(metric):
+    def engine(weights):
+        shared = gram_intermediates(weights, [metric])
+        return dense_blocks(lambda start, stop: metric_rows(shared, metric, start, stop),
+                            weights.shape[0])
+    return engine
+
+def reference_probability(weights):
+    from tools.jaccard_probability_measure import jaccard_probability_distribution
+    with open(os.devnull, 'w') as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            return np.array(jaccard_probability_distribution(weights.toarray()))
+        finally:
+            sys.stdout = stdout
+
+# metric -> (reference, {engine: function}), the reference an engine
+# too; each function takes the sources x entries weights and returns the
+# similarity, dense or sparse
+benchmark_engines = {
+    'jaccard': ('dense', {
+        'dense': lambda w: similarity_from_metric(as_frame(w), 'jaccard').values,
+        'sets': lambda w: jaccard_similarity(as_frame(w)).values,
+        'sparse': sparse_jaccard,
+        'blocked': blocked_jaccard,
+        'multi': multi_rows('jaccard'),
+        'lsh': lsh_jaccard,
+    }),
+    'jaccard_probability': ('loop', {
+        'loop': reference_probability,
+        'sparse': sparse_jaccard_probability,
+        'rows': lambda w: similarity_rows(w, np.arange(w.shape[0]), 'jaccard_probability'),
+    }),
+    'cosine': ('dense', {
+        'dense': lambda w: similarity_from_metric(as_frame(w), 'cosine').values,
+        'multi': multi_rows('cosine'),
+    }),
+    'hamming': ('dense', {
+        'dense': lambda w: similarity_from_metric(as_frame(w), 'hamming').values,
+        'multi': multi_rows('hamming'),
+    }),
+}
+
+# engines too slow for more rows than this; the references are replaced
+# by the sparse engine beyond it
+slow_engines = {'sets': 100, 'loop': 100}
+
+def measure(function, *args):
+    """Run function twice: untraced for its time, traced for its peak memory"""
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    result = function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak / 2**20
+
+def compare(result, reference, weights):
+    """Largest difference off the diagonal, between rows that aren't empty
+
+    Implementations disagree by convention on the diagonal and on empty
+    rows, not on anything else.
+    """
+    result = result.toarray() if sparse.issparse(result) else np.asarray(result)
+    reference = reference.toarray() if sparse.issparse(reference) else np.asarray(reference)
+    nonempty = np.diff(to_boolean(weights).indptr) > 0
+    mask = np.outer(nonempty, nonempty)
+    np.fill_diagonal(mask, False)
+    return float(np.abs(result - reference)[mask].max()) if mask.any() else 0.0
+
+def benchmark(sizes, densities, seed=0):
+    """Time every engine and check it against its reference, as a report"""
+    cases = []
+    for rows in sizes:
+        for density in densities:
+            weights = synthetic_weights(rows, 2 * rows, density, seed)
+            for metric, (reference, engines) in benchmark_engines.items():
+                if rows > slow_engines.get(reference, rows):
+                    reference = 'sparse'
+                expected = None
+                for name in [reference] + [name for name in engines if name != reference]:
+                    if rows > slow_engines.get(name, rows):
+                        continue
+                    result, seconds, peak = measure(engines[name], weights)
+                    entry = {'rows': rows, 'columns': 2 * rows, 'density': density,
+                             'nnz': int(weights.nnz), 'metric': metric, 'engine': name,
+                             'reference': reference, 'seconds': seconds, 'peak_mb': peak}
+                    if expected is None:
+                        expected = result.toarray() if sparse.issparse(result) else result
+                        entry['max_diff'] = 0.0
+                    elif name == 'lsh':
+                        # approximate: exact where found, and some pairs missed
+                        found = result.toarray() > 0
+                        entry['max_diff'] = compare(np.where(found, result.toarray(), expected),
+                                                    expected, weights)
+                        hits, similar = lsh_recall(weights, result, 0.5)
+                        entry['recall'] = hits / similar if similar else 1.0
+                    else:
+                        entry['max_diff'] = compare(result, expected, weights)
+                    # the output is rounded to 3 places
+                    entry['agrees'] = entry['max_diff'] < 5e-4
+                    cases.append(entry)
+                    print('{rows:>6} {density:<6} {metric:<20} {engine:<8} {seconds:8.3f}s '
+                          '{peak_mb:8.1f}MB  max diff {max_diff:.2g}'.format(**entry))
+    return {'python': sys.version.split()[0], 'numpy': np.__version__, 'seed': seed,
+            'cases': cases}
 
 # this is the main function
 def main():    
     args = docopt(__doc__)
 
+    if args['--benchmark']:
+        sizes = [int(size) for size in args['--sizes'].split(',')]
+        densities = [float(density) for density in args['--densities'].split(',')]
+        report = benchmark(sizes, densities)
+        if os.path.dirname(args['--report']):
+            os.makedirs(os.path.dirname(args['--report']), exist_ok=True)
+        with open(args['--report'], 'w') as f:
+            json.dump(report, f, indent=2)
+        failed = [case for case in report['cases'] if not case['agrees']]
+        print('{} of {} cases agree with their reference, report in {}'.format(
+            len(report['cases']) - len(failed), len(report['cases']), args['--report']))
+        sys.exit(1 if failed else 0)
+
     input_file = args['-i']
     output_file = args['-o']
 
-    # test the functions
-    # test()
-
     # check if the input file exists
-    if not os.path.isfile(input_file):
+    if not os.path.exists(input_file):
         print('input file does not exist')
         sys.exit(1)
     # if output file not specified, use the default
@@ -144,6 +932,74 @@ def main():
         print('input and output files cannot be the same')
         sys.exit(1)
     
+    store = None
+    if not args['--no-store']:
+        store = args['--store'] or os.path.splitext(output_file)[0] + '.store'
+    metric = args['--metric']
+    jobs = int(args['--jobs']) if args['--jobs'] else None
+    memory = float(args['--memory']) if args['--memory'] else None
+    top_k = int(args['--top-k']) if args['--top-k'] else None
+    min_sim = float(args['--min-sim']) if args['--min-sim'] else None
+    if args['--metrics']:
+        metrics = args['--metrics'].split(',')
+        unknown = [metric for metric in metrics if metric not in multi_metrics]
+        if unknown:
+            print('unknown metrics: {}'.format(', '.join(unknown)))
+            sys.exit(1)
+        multi_similarity(input_file, output_file, metrics, top_k, min_sim)
+        return
+    if args['--incremental'] and store and args['--engine'] == 'sparse':
+        if incremental_similarity(input_file, output_file, store, metric, top_k, min_sim):
+            return
+    if jobs or memory:
+        if args['--engine'] != 'sparse' or metric not in sparse_metrics:
+            print('blocks are computed by the sparse engine only')
+            sys.exit(1)
+        blocked_similarity(input_file, output_file, metric, jobs or 1,
+                           (memory or 1024) * 2**20, top_k, min_sim, store)
+        if store:
+            record_run(store, input_file, 'sparse', metric)
+        return
+    if args['--engine'] in ('sparse', 'lsh'):
+        if args['--engine'] == 'lsh' and metric != 'jaccard':
+            print('the lsh engine only approximates the jaccard')
+            sys.exit(1)
+        if metric not in sparse_metrics:
+            print('unknown metric for the sparse engine: {}'.format(metric))
+            sys.exit(1)
+        if args['--engine'] == 'lsh':
+            perms, bands = int(args['--perms']), int(args['--bands'])
+            if perms < 1 or bands < 1 or bands > perms:
+                print('--bands must be between 1 and --perms')
+                sys.exit(1)
+            if perms % bands:
+                print('--bands must divide --perms, {} is not a multiple of {}'.format(
+                    perms, bands))
+                sys.exit(1)
+            sources, weights = load_weights(input_file)
+            sim = lsh_jaccard(weights, perms, bands)
+            if args['--recall']:
+                at_least = min_sim if min_sim is not None else (1 / bands) ** (bands / perms)
+                found, similar = lsh_recall(weights, sim, at_least)
+                print('LSH recall at similarity >= {:.3f}: {:.3f} ({} of {} pairs)'.format(
+                    at_least, found / similar if similar else 1.0, found, similar))
+        else:
+            sources, sim = sparse_similarity(input_file, metric)
+        if store:
+            write_store(store, sources, sim)
+            record_run(store, input_file, args['--engine'], metric)
+        if top_k or min_sim is not None:
+            sim_dict = top_k_by_similarity(sim, sources, top_k, min_sim)
+        else:
+            sim_matrix = pd.DataFrame(sim.toarray(), index=sources, columns=sources)
+            sim_dict = sort_by_similarity(sim_matrix.round(3))
+        with open(output_file, 'w') as f:
+            json.dump(sim_dict, f, indent=2)
+        return
+    elif args['--engine'] != 'dense':
+        print('unknown engine: {}'.format(args['--engine']))
+        sys.exit(1)
+
     # construct dataframes from the json file
     df = pd.read_json(input_file)
     df = df[~df.index.str.contains("topics")]
@@ -165,9 +1021,16 @@ def main():
     # compute the similarity matrix, and save
     # a sorted dictionary to a json file
     '''see notes'''
-    sim_matrix = similarity_from_metric(df, 'jaccard')
-    sim_matrix = sim_matrix.round(3)
-    sim_dict = sort_by_similarity(sim_matrix)
+    sim_matrix = similarity_from_metric(df, metric)
+    if store:
+        write_store(store, list(sim_matrix.columns), sim_matrix.values)
+        record_run(store, input_file, 'dense', metric)
+    if top_k or min_sim is not None:
+        sim_dict = top_k_by_similarity(sim_matrix.values, list(sim_matrix.columns),
+                                       top_k, min_sim)
+    else:
+        sim_matrix = sim_matrix.round(3)
+        sim_dict = sort_by_similarity(sim_matrix)
     with open(output_file, 'w') as f:
         json.dump(sim_dict, f, indent=2)
 
@@ -180,6 +1043,11 @@ if __name__ == "__main__":
     Unfortunately, the jaccard similarity converts the weights to
     binary values, so we need to convert them back to weights
 
+    [Update: --metric=jaccard_probability now does this, with a
+    vectorized version of the measure below, see
+    sparse_jaccard_probability().  It runs in about the time of the
+    sparse jaccard.  The rest of these notes predate it.]
+
     This is actually a pretty non-trivial problem:
     - https://arxiv.org/pdf/1809.04052.pdf
     and there is no weighted algorithm for jaccard metrics with 
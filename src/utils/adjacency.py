@@ -0,0 +1,135 @@
+import json
+import os.path
+
+import numpy as np
+from scipy import sparse
+
+##
+# The graph as an adjacency index, so a slice around a few ingredients
+# reads their neighbourhoods instead of all of edges.json.  A directory:
+#
+#   names.json        the nodes, in the order of nodes.json; a name's id
+#                     is its index
+#   out_indptr.npy  \
+#   out_indices.npy  > the edges by their from node, in CSR form, with
+#   out_data.npy    /  their weights, in the dtype of edges.json
+#   in_*.npy          the same by their to node, so a node's neighbours
+#                     either way are two slices
+#   reciprocal.npy    for an --undirected graph, each edge's flag, in the
+#                     order of out_data.npy
+#
+# Every array is memory-mapped on open, and a slice reads only the rows
+# of the nodes it reaches.
+##
+
+def _save_csr(path, prefix, matrix):
+    # one index type for both, or scipy would copy them on load
+    index = np.int32 if matrix.nnz < 2**31 else np.int64
+    np.save(os.path.join(path, prefix + '_indptr.npy'), matrix.indptr.astype(index))
+    np.save(os.path.join(path, prefix + '_indices.npy'), matrix.indices.astype(index))
+    np.save(os.path.join(path, prefix + '_data.npy'), matrix.data)
+
+def _load_csr(path, prefix, n):
+    indptr, indices, data = (np.load(os.path.join(path, prefix + suffix), mmap_mode='r')
+                             for suffix in ('_indptr.npy', '_indices.npy', '_data.npy'))
+    return sparse.csr_matrix((data, indices, indptr), shape=(n, n), copy=False)
+
+def write_index(path, names, sources, targets, weights, reciprocal=None):
+    """Write the edges (columns of node ids) as an adjacency index"""
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'names.json'), 'w') as f:
+        json.dump(list(names), f)
+    n = len(names)
+    # sorted by (from, to) by hand, as the coo -> csr conversion would sum
+    # duplicate edges, and weights of 0 have to stay
+    order = np.lexsort((targets, sources))
+    counts = np.bincount(sources, minlength=n)
+    out = sparse.csr_matrix((np.asarray(weights)[order], targets[order],
+                             np.concatenate([[0], np.cumsum(counts)])), shape=(n, n))
+    _save_csr(path, 'out', out)
+    _save_csr(path, 'in', out.T.tocsr())
+    if reciprocal is not None:
+        np.save(os.path.join(path, 'reciprocal.npy'), np.asarray(reciprocal)[order])
+
+def is_index(path):
+    return os.path.isfile(os.path.join(path, 'names.json')) and \
+        os.path.isfile(os.path.join(path, 'out_indptr.npy'))
+
+def _gather(matrix, rows):
+    """The entries of some rows of a csr matrix, as rows, columns and positions in data"""
+    starts, ends = matrix.indptr[rows], matrix.indptr[rows + 1]
+    counts = ends - starts
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    positions = offsets + np.arange(counts.sum())
+    return np.repeat(rows, counts), matrix.indices[positions], positions
+
+class adjacencyIndex:
+    """A memory-mapped adjacency index, sliced by ingredient name"""
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'names.json')) as f:
+            self.names = json.load(f)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        n = len(self.names)
+        self.out = _load_csr(path, 'out', n)
+        self.into = _load_csr(path, 'in', n)
+        reciprocal = os.path.join(path, 'reciprocal.npy')
+        self.reciprocal = np.load(reciprocal, mmap_mode='r') if os.path.isfile(reciprocal) else None
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def neighbours(self, ids, min_weight=None, max_neighbours=None):
+        """Ids of the nodes next to any of ids, along edges either way
+
+        Only edges of at least min_weight are followed, and from each node
+        only its max_neighbours heaviest ones (ties by id).
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        rows, cols, weights = [], [], []
+        for matrix in (self.out, self.into):
+            r, c, positions = _gather(matrix, ids)
+            rows.append(r)
+            cols.append(c)
+            weights.append(matrix.data[positions])
+        rows, cols, weights = np.concatenate(rows), np.concatenate(cols), np.concatenate(weights)
+        if min_weight is not None:
+            keep = weights >= min_weight
+            rows, cols, weights = rows[keep], cols[keep], weights[keep]
+        if max_neighbours is not None:
+            # each node's neighbours heaviest first, once each, then ranked
+            order = np.lexsort((cols, -weights, rows))
+            rows, cols = rows[order], cols[order]
+            _, first = np.unique(rows * len(self.names) + cols, return_index=True)
+            first.sort()
+            rows, cols = rows[first], cols[first]
+            rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+            cols = cols[rank < max_neighbours]
+        return np.unique(cols)
+
+    def slice(self, names, hops=1, min_weight=None, max_neighbours=None):
+        """The nodes within hops of the named ones, and the edges between them
+
+        Returns the node ids, sorted, and the edges as columns: from and to
+        ids, weights, and the reciprocal flags (or None).  Names not in the
+        graph are left out.
+        """
+        selected = np.zeros(len(self.names), dtype=bool)
+        frontier = np.array([self.ids[name] for name in names if name in self.ids], dtype=np.int64)
+        selected[frontier] = True
+        for _ in range(hops):
+            if not len(frontier):
+                break
+            reached = self.neighbours(frontier, min_weight, max_neighbours)
+            frontier = reached[~selected[reached]]
+            selected[frontier] = True
+
+        nodes = np.flatnonzero(selected)
+        sources, targets, positions = _gather(self.out, nodes)
+        weights = self.out.data[positions]
+        keep = selected[targets]
+        if min_weight is not None:
+            keep &= weights >= min_weight
+        positions = positions[keep]
+        reciprocal = None if self.reciprocal is None else self.reciprocal[positions]
+        return nodes, sources[keep], targets[keep], weights[keep], reciprocal
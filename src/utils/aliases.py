@@ -0,0 +1,118 @@
+import re
+from collections import defaultdict
+
+from rapidfuzz.distance import OSA
+
+##
+# Find near-duplicate ingredient names, without comparing all pairs:
+#
+#   'cheese, parmesan' ~ 'parmesan cheese'   an inverted name
+#   'truffels' ~ 'truffles'   one typo (an edit or a transposition)
+#
+# Names are blocked twice.  By their canonical form (lower case, an
+# inverted 'X, Y' read as 'Y X', words in order) -- names sharing one are
+# the same.  And for typos, by all of their tokens but one, where that
+# one is, its length, and its first or last two letters.  A typo pair has
+# every token but one in common, and the one that differs is long
+# (min_token letters or more) and one edit from the other's; one edit
+# leaves either its first or its last two letters intact, so each typo
+# pair shares a bucket, and only pairs within a bucket (and the bucket of
+# tokens one letter longer) are compared.  Short tokens are never
+# typo-merged: 'green tea' and 'green peas', or 'dill seed' and 'dill
+# weed', are different ingredients.  Nor are plurals ('pepper' and
+# 'peppers') or the same words in another order ('chocolate milk' and
+# 'milk chocolate').
+##
+
+def canonical(name):
+    name = name.lower()
+    if name.count(',') == 1:
+        head, tail = name.split(',')
+        name = tail + ' ' + head
+    return ' '.join(re.findall(r'[\w-]+', name))
+
+def is_plural(a, b):
+    """Is one token the other with an s, or es"""
+    a, b = sorted((a, b), key=len)
+    return b in (a + 's', a + 'es')
+
+def preference(name, counts, sources):
+    # the name to keep: a source ingredient, mentioned most, and not
+    # inverted like 'cheese, parmesan'
+    return (name in sources, counts.get(name, 0), ',' not in name)
+
+def find_aliases(names, counts=None, sources=(), min_length=7, min_token=6, max_bucket=200):
+    """Map each near-duplicate name to the name to use instead
+
+    counts (name -> mentions) and sources (names with entries of their
+    own) decide which name of a group is kept; a group where two names
+    tie for it is reported and left alone.  A typo pair needs one of its
+    forms to have min_length letters, and its differing tokens one to
+    have min_token.
+    """
+    names = list(names)
+    counts = counts or {}
+    sources = set(sources)
+    forms = {name: canonical(name) for name in names}
+
+    # union-find over names
+    parent = {name: name for name in names}
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    def union(a, b):
+        parent[find(a)] = find(b)
+
+    # same canonical form
+    by_form = defaultdict(list)
+    for name in names:
+        by_form[forms[name]].append(name)
+    for group in by_form.values():
+        for name in group[1:]:
+            union(group[0], name)
+
+    # one typo apart, in one long token, within a bucket; a form one letter
+    # short of min_length may still pair with one that reaches it
+    buckets = defaultdict(list)
+    for form in by_form:
+        if len(form) < min_length - 1:
+            continue
+        tokens = form.split(' ')
+        for i, token in enumerate(tokens):
+            if len(token) < min_token - 1:
+                continue
+            rest = ' '.join(tokens[:i] + ['*'] + tokens[i + 1:])
+            buckets[rest, '<' + token[:2], len(token)].append((form, token))
+            buckets[rest, token[-2:] + '>', len(token)].append((form, token))
+    for (rest, affix, length), bucket in buckets.items():
+        longer = buckets.get((rest, affix, length + 1), [])
+        if len(bucket) + len(longer) > max_bucket:
+            continue
+        for i, (a, a_token) in enumerate(bucket):
+            for b, b_token in bucket[i + 1:] + longer:
+                if max(len(a), len(b)) < min_length or max(len(a_token), len(b_token)) < min_token:
+                    continue
+                if is_plural(a_token, b_token):
+                    continue
+                if OSA.distance(a_token, b_token, score_cutoff=1) <= 1:
+                    union(by_form[a][0], by_form[b][0])
+
+    groups = defaultdict(list)
+    for name in names:
+        groups[find(name)].append(name)
+    aliases = {}
+    for group in groups.values():
+        if len(group) < 2:
+            continue
+        ranked = sorted(group, key=lambda name: preference(name, counts, sources),
+                        reverse=True)
+        if preference(ranked[0], counts, sources) == preference(ranked[1], counts, sources):
+            print('Warn: no name to keep among {}, not merged'.format(', '.join(sorted(group))))
+            continue
+        keep = ranked[0]
+        for name in group:
+            if name != keep:
+                aliases[name] = keep
+    return aliases
@@ -1,6 +1,13 @@
 import re
+from collections import namedtuple
 
-def parse_brackets(X, bra, ket, sep):
+# text:  an item of the list, stripped
+# start: where the item starts in the input
+# end:   where the item ends in the input
+# depth: how many bra..ket groups the item sits in
+Bracketed = namedtuple('Bracketed', ['text', 'start', 'end', 'depth'])
+
+def tokenize_brackets(X, bra, ket, sep, nest=None):
 
     r'''
     Input:
@@ -10,65 +17,80 @@ def parse_brackets(X, bra, ket, sep):
         bra = '\[LB.'
         ket = 'RB\]'
     Output:
-        Y = ['hello', 'A 1.0', 'B 1.0', 'C', 'D', 'E']
-    NB: This does not iterate, and regex wizards know better than I how to
-        do this succinctly, this approach is familiar to me since you do
-        it a lot in finite element methods.
+        [('hello', 0, 5, 0), ('A 1.0', 11, 16, 1), ('B 1.0', 18, 23, 1),
+         ('C', 28, 29, 0), ('D', 31, 32, 0), ('E', 38, 39, 1), ('F', 40, 41, 1)]
+        (offsets as if X were unescaped)
 
     Strategy:
-   
+
       X:  ---------[*,*,*,*]-----[*,*]----,---[*]-----
-      0:  [---L---][---P---][-----------R------------]
-      1:  .........[q,q,q,q][-L-][-P-][------R-------]
-      2:  .......................[q,q][---L--][P][-R-]          
-      3:  ....................................[q][-L-]
-      Y:  ............................................
-   
-    N.B. this won't work on nested parens
+          ^ one scan for the next bra, ket or sep, left to right;
+            each one ends the current item, and bra/ket step the depth
+
+    Groups can nest, e.g. '(e.g., port (e.g., tawny), sherry)'.  A ket with
+    no open group is left in the text, as is anything matching nest, an
+    optional pattern for plain brackets inside an item, along with its ket
+    and any sep inside it:  nest = r'\(' keeps 'dry (sauce)' in one piece.
     '''
 
-    # determine P blocks
-    pattern = bra+'.*?'+ket
-    P = re.findall(pattern, X)
-         
-    # then index the content of the P blocks with Q:
-    Q = []
-    for i in range(len(P)):
-        p = P[i]
-        q = re.sub(bra, '', p).strip()
-        q = re.sub(ket, '', q).strip()
-        Q.append(q)
-
-    # P has context, while Q is a list of strings q_k seperated by, say, ',': 
-    #   " P = (e.g., q_0,[.k.,]q_i]) "
-    # 1. step through X using P's to separate a L-side and a R-side (i),
-    # 2. then, step through the strings l in L and record them with Y (j)
-    # 3. repeat using L and R of next P block, but let's record inside 
-    #   of previous P block and subdivide it into q's in k-space
+    scanner = re.compile('|'.join(
+        '(?P<{}>{})'.format(kind, pattern) for kind, pattern in
+        [('bra', bra), ('nest', nest), ('ket', ket), ('sep', re.escape(sep))]
+        if pattern))
 
     Y = []
-    for i in range(len(P)):
-        L = X.split(P[i])[0]
-        R = X.split(P[i])[1]
-        left = L.split(sep)
-        for j in range(len(left)):
-            Y.append(left[j].strip())
-        q = Q[i].split(sep)
-        for k in range(len(q)):
-            Y.append(q[k].strip())
-        # set the next starting place, just right of previous P-block
-        X = R
-
-    # maybe there's entries after the last P-block too
-    left = R.split(sep)
-    for j in range(len(left)):
-        Y.append(left[j].strip())
-
-    # finally, we can remove any empty entries from the list: 
-    Y = [y for y in Y if y != '' and y != ' ']
+    depth = 0
+    plain = 0
+    start = 0
+
+    def item(end):
+        x = X[start:end]
+        text = x.strip()
+        if text:
+            left = start + len(x) - len(x.lstrip())
+            Y.append(Bracketed(text, left, left + len(text), depth))
+
+    for m in scanner.finditer(X):
+        kind = m.lastgroup
+        if plain:
+            # inside plain brackets, everything is text until they close
+            if kind == 'bra' or kind == 'nest':
+                plain += 1
+            elif kind == 'ket':
+                plain -= 1
+            continue
+        if kind == 'nest':
+            plain += 1
+            continue
+        if kind == 'ket' and depth == 0:
+            continue
+        item(m.start())
+        start = m.end()
+        if kind == 'bra':
+            depth += 1
+        elif kind == 'ket':
+            depth -= 1
+    item(len(X))
 
     return Y
 
+def parse_brackets(X, bra, ket, sep, nest=None):
+
+    r'''
+    Input:
+        X = 'hello, \[LB.A 1.0, B 1.0RB\], C, D \[LB. E,FRB\]'
+    Config:
+        sep = ','
+        bra = '\[LB.'
+        ket = 'RB\]'
+    Output:
+        Y = ['hello', 'A 1.0', 'B 1.0', 'C', 'D', 'E', 'F']
+
+    The items of tokenize_brackets, without their offsets.
+    '''
+
+    return [y.text for y in tokenize_brackets(X, bra, ket, sep, nest=nest)]
+
 '''
 # Testing examples:
 bra = r'\(e.g.,'
@@ -0,0 +1,169 @@
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, eigsh
+
+##
+# Node metrics of the ingredient graph, for the demo to colour and size
+# by, all in sparse linear algebra:
+#
+#   pagerank      weighted, along the edges as listed: an ingredient
+#                 ranks high when high-ranking ingredients list it
+#   eigenvector   the leading eigenvector of the weights taken both ways,
+#                 with unit length
+#   community     a partition by Newman's leading eigenvector method:
+#                 groups are split in two by the sign of the modularity
+#                 matrix's leading eigenvector, for as long as a split
+#                 adds modularity, then fine-tuned by moving single
+#                 nodes to the neighbouring group that gains the most
+#
+# Edges of weight 0 take no part in any of them.
+##
+
+def weight_matrix(n, sources, targets, weights):
+    """The n x n sparse matrix of edge weights, from -> to"""
+    return sparse.csr_matrix((np.asarray(weights, dtype=np.float64), (sources, targets)),
+                             shape=(n, n))
+
+def pagerank(weights, damping=0.85, tol=1e-10, max_iter=100):
+    """Weighted PageRank by power iteration
+
+    A node without outgoing weight spreads its rank evenly over all nodes.
+    """
+    n = weights.shape[0]
+    if n == 0:
+        return np.empty(0)
+    out = np.asarray(weights.sum(axis=1)).ravel()
+    dangling = out == 0
+    # the transition matrix, transposed: column i is where i's rank goes
+    transition = (sparse.diags(np.where(dangling, 0, 1 / np.where(dangling, 1, out)))
+                  @ weights).T.tocsr()
+    rank = np.full(n, 1 / n)
+    for _ in range(max_iter):
+        last = rank
+        rank = damping * (transition @ rank + rank[dangling].sum() / n) + (1 - damping) / n
+        if np.abs(rank - last).sum() < tol:
+            break
+    return rank / rank.sum()
+
+def eigenvector_centrality(symmetric):
+    """The leading eigenvector of a symmetric weight matrix, non-negative and of unit length"""
+    n = symmetric.shape[0]
+    if n == 0:
+        return np.empty(0)
+    if n < 3:
+        _, vectors = np.linalg.eigh(symmetric.toarray())
+        vector = vectors[:, -1]
+    else:
+        _, vectors = eigsh(symmetric, k=1, which='LA', v0=np.ones(n))
+        vector = vectors[:, 0]
+    vector = np.abs(vector)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+def leading_split(adjacency, degree, m):
+    """Split a group in two by modularity, or None if no split adds any
+
+    adjacency is the group's part of the weights, degree its nodes' total
+    weights in the whole graph, and m the graph's total weight.
+    """
+    n = adjacency.shape[0]
+    # the group's generalized modularity matrix is
+    #   B = A - k k^T / 2m - diag(rowsum(A) - k sum(k) / 2m)
+    diagonal = np.asarray(adjacency.sum(axis=1)).ravel() - degree * degree.sum() / (2 * m)
+    def apply(x):
+        return adjacency @ x - degree * (degree @ x) / (2 * m) - diagonal * x
+    if n <= 100:
+        B = adjacency.toarray() - np.outer(degree, degree) / (2 * m) - np.diag(diagonal)
+        values, vectors = np.linalg.eigh(B)
+        value, vector = values[-1], vectors[:, -1]
+    else:
+        operator = LinearOperator((n, n), matvec=apply, dtype=np.float64)
+        values, vectors = eigsh(operator, k=1, which='LA',
+                                v0=np.random.default_rng(0).random(n))
+        value, vector = values[0], vectors[:, 0]
+    if value <= 1e-10:
+        return None
+    side = vector >= 0
+    s = np.where(side, 1.0, -1.0)
+    if side.all() or not side.any() or s @ apply(s) / (4 * m) <= 1e-10:
+        return None
+    return side
+
+def refine(symmetric, community, max_passes=10):
+    """Move nodes, one at a time, to the community that gains the most modularity"""
+    degree = np.asarray(symmetric.sum(axis=1)).ravel()
+    m = degree.sum() / 2
+    self_loops = symmetric.diagonal()
+    # each node's weight into each community, and each community's total
+    n = len(community)
+    members = sparse.csr_matrix((np.ones(n), (np.arange(n), community)))
+    links = (symmetric @ members).toarray()
+    totals = np.bincount(community, weights=degree, minlength=links.shape[1])
+    for _ in range(max_passes):
+        moved = 0
+        for i in np.flatnonzero(degree > 0):
+            a = community[i]
+            gain = (links[i] - degree[i] * totals / (2 * m)) / m
+            # staying put, as if i were taken out and put back
+            gain[a] = (links[i, a] - self_loops[i]
+                       - degree[i] * (totals[a] - degree[i]) / (2 * m)) / m
+            b = int(np.argmax(gain))
+            if b == a or gain[b] - gain[a] <= 1e-12:
+                continue
+            start, end = symmetric.indptr[i], symmetric.indptr[i + 1]
+            neighbours, weights = symmetric.indices[start:end], symmetric.data[start:end]
+            links[neighbours, a] -= weights
+            links[neighbours, b] += weights
+            totals[a] -= degree[i]
+            totals[b] += degree[i]
+            community[i] = b
+            moved += 1
+        if not moved:
+            break
+    return community
+
+def communities(symmetric):
+    """Community of each node, numbered from the largest"""
+    n = symmetric.shape[0]
+    degree = np.asarray(symmetric.sum(axis=1)).ravel()
+    m = degree.sum() / 2
+    groups = []
+    # nodes without weight don't belong with anyone
+    pending = [np.flatnonzero(degree > 0)] if m > 0 else []
+    groups += [np.array([i]) for i in np.flatnonzero(degree == 0)]
+    while pending:
+        group = pending.pop()
+        side = None
+        if len(group) > 1:
+            side = leading_split(symmetric[group][:, group], degree[group], m)
+        if side is None:
+            groups.append(group)
+        else:
+            pending += [group[side], group[~side]]
+
+    community = np.empty(n, dtype=np.int64)
+    for i, group in enumerate(groups):
+        community[group] = i
+    if m > 0:
+        community = refine(symmetric.tocsr(), community)
+
+    # renumbered by size, then by first node
+    sizes = np.bincount(community, minlength=len(groups))
+    firsts = np.full(len(groups), n)
+    np.minimum.at(firsts, community, np.arange(n))
+    order = np.lexsort((firsts, -sizes))
+    order = order[sizes[order] > 0]
+    number = np.empty(len(groups), dtype=np.int64)
+    number[order] = np.arange(len(order))
+    return number[community]
+
+def modularity(symmetric, community):
+    """Newman's modularity of a partition of a symmetric weight matrix"""
+    degree = np.asarray(symmetric.sum(axis=1)).ravel()
+    m = degree.sum() / 2
+    if m == 0:
+        return 0.0
+    coo = symmetric.tocoo()
+    inside = coo.data[community[coo.row] == community[coo.col]].sum()
+    totals = np.bincount(community, weights=degree)
+    return inside / (2 * m) - (totals ** 2).sum() / (2 * m) ** 2
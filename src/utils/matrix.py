@@ -0,0 +1,85 @@
+import json
+import os.path
+from array import array
+
+import numpy as np
+from scipy import sparse
+
+##
+# The clean bible as an ingredient x ingredient matrix of weights, row
+# ingredient -> column entry, kept as plain .npy files in a directory so
+# they can be memory-mapped instead of parsed:
+#
+#   names.json    the vocabulary, sorted; a name's id is its index
+#   sources.npy   ids of the ingredients with a row in clean.json
+#   indptr.npy    \
+#   indices.npy    > the weights, in compressed sparse row (CSR) form
+#   data.npy      /
+#
+# Only nonzero weights are stored, and 'topics'/'affinities' are left out.
+##
+
+class matrixBuilder:
+    """Intern names and collect weights, one ingredient at a time"""
+
+    def __init__(self):
+        self.ids = {}
+        self.sources = array('q')
+        self.rows = array('q')
+        self.cols = array('q')
+        self.data = array('f')
+
+    def intern(self, name):
+        return self.ids.setdefault(name, len(self.ids))
+
+    def add(self, key, entries):
+        row = self.intern(key)
+        self.sources.append(row)
+        for entry, weight in entries.items():
+            if isinstance(weight, (int, float)) and weight != 0:
+                self.rows.append(row)
+                self.cols.append(self.intern(entry))
+                self.data.append(weight)
+
+    def build(self):
+        """The names, source ids and CSR weights, in memory"""
+        names = sorted(self.ids)
+        # from the order names were seen in, to sorted order
+        new_id = np.empty(len(names), dtype=np.int32)
+        new_id[[self.ids[name] for name in names]] = np.arange(len(names), dtype=np.int32)
+
+        rows = new_id[np.frombuffer(self.rows, dtype=np.int64)]
+        cols = new_id[np.frombuffer(self.cols, dtype=np.int64)]
+        data = np.frombuffer(self.data, dtype=np.float32)
+        weights = sparse.csr_matrix((data, (rows, cols)), shape=(len(names), len(names)))
+        weights.sort_indices()
+        sources = np.sort(new_id[np.frombuffer(self.sources, dtype=np.int64)])
+        return names, sources, weights
+
+    def save(self, path):
+        save_matrix(path, *self.build())
+
+def save_matrix(path, names, sources, weights):
+    """Save names, source ids and CSR weights, as load_matrix reads them"""
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'names.json'), 'w') as f:
+        json.dump(names, f)
+    np.save(os.path.join(path, 'sources.npy'), sources)
+    # one index type for both, or scipy would copy them on load
+    index = np.int32 if weights.nnz < 2**31 else np.int64
+    np.save(os.path.join(path, 'indptr.npy'), weights.indptr.astype(index))
+    np.save(os.path.join(path, 'indices.npy'), weights.indices.astype(index))
+    np.save(os.path.join(path, 'data.npy'), weights.data.astype(np.float32))
+
+def load_matrix(path, mmap=True):
+    """Load names, source ids and the CSR weights, memory-mapped by default"""
+    mode = 'r' if mmap else None
+    with open(os.path.join(path, 'names.json')) as f:
+        names = json.load(f)
+    sources = np.load(os.path.join(path, 'sources.npy'), mmap_mode=mode)
+    indptr = np.load(os.path.join(path, 'indptr.npy'), mmap_mode=mode)
+    indices = np.load(os.path.join(path, 'indices.npy'), mmap_mode=mode)
+    data = np.load(os.path.join(path, 'data.npy'), mmap_mode=mode)
+    weights = sparse.csr_matrix((data, indices, indptr),
+                                shape=(len(names), len(names)), copy=False)
+    return names, sources, weights
@@ -0,0 +1,28 @@
+import json
+
+##
+# Newline-delimited json, one ingredient per line:
+#
+#   {"BASIL": {"basil": 0, "garlic": 1, /* ... */}}
+#   {"BEANS": {/* ... */}}
+#
+# so a file can be written as each ingredient is finished and read back
+# one ingredient at a time.  Read into a dict, a later line for the same
+# ingredient replaces an earlier one, as with json.load.
+##
+
+def is_ndjson(path):
+    return path.endswith('.ndjson')
+
+def write_records(file, records, sort_keys=False):
+    """Write (key, value) records to an open file, one per line"""
+    for key, value in records:
+        file.write(json.dumps({key: value}, sort_keys=sort_keys) + '\n')
+
+def iter_records(path):
+    """Yield the (key, value) records of a file, one line at a time"""
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                yield from record.items()
@@ -0,0 +1,207 @@
+from collections import namedtuple
+from html.parser import HTMLParser
+
+##
+# A streaming alternative to BeautifulSoup(...).find_all("p", class_=...):
+# only the matching <p> elements are kept, and only as much of them as the
+# parser needs -- their text, their direct children and their <strong> spans.
+##
+
+# classes:     the paragraph's class list, e.g. ['ul']
+# text:        all of the paragraph's text, like Tag.text
+# children:    (text, tag) for each direct child, tag is None for bare text
+#              and comment for a comment, whose text is the comment's
+# strongs:     the text of each <strong> in the paragraph, in order
+# strong_lead: whether the first <strong> has a previous sibling
+# runs:        (text, bold) for each string in the paragraph, in order
+Paragraph = namedtuple('Paragraph',
+                       ['classes', 'text', 'children', 'strongs', 'strong_lead', 'runs'])
+
+ascii_spaces = ' \n\t\f\r'
+
+# the tag of a comment child; BeautifulSoup keeps comments as children,
+# but leaves them out of the text
+comment = '#comment'
+
+# these never get an end tag in html
+void_tags = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+             'link', 'meta', 'param', 'source', 'track', 'wbr'}
+
+def collapse(data):
+    # BeautifulSoup collapses whitespace-only strings to one character
+    if not data.strip(ascii_spaces):
+        return '\n' if '\n' in data else ' '
+    return data
+
+class openParagraph:
+    """A matching paragraph being parsed, open at depth in the element stack"""
+
+    def __init__(self, classes, depth, index):
+        self.classes = classes
+        self.depth = depth
+        self.index = index
+        self.text = []
+        self.runs = []
+        self.children = []
+        self.child_tag = None
+        self.child_text = []
+        self.strongs = []
+        self.strong_text = []
+        self.strong_lead = None
+
+    def is_child(self, stack):
+        return len(stack) == self.depth + 1
+
+    def open_child(self, tag, stack, had_children):
+        if tag == 'strong':
+            if self.strong_lead is None:
+                self.strong_lead = had_children
+            self.strongs.append([])
+            self.strong_text.append(self.strongs[-1])
+        if self.is_child(stack):
+            self.child_tag = tag
+            self.child_text = []
+
+    def close_child(self, tag, stack):
+        if tag == 'strong':
+            self.strong_text.pop()
+        if self.is_child(stack):
+            self.children.append((''.join(self.child_text), self.child_tag))
+
+    def add_text(self, data, stack):
+        self.text.append(data)
+        self.runs.append((data, bool(self.strong_text)))
+        for strong in self.strong_text:
+            strong.append(data)
+        if self.is_child(stack):
+            self.children.append((data, None))
+        else:
+            self.child_text.append(data)
+
+    def record(self):
+        return Paragraph(self.classes, ''.join(self.text), self.children,
+                         [''.join(s) for s in self.strongs], bool(self.strong_lead), self.runs)
+
+class paragraphParser(HTMLParser):
+    """Collect matching paragraphs as Paragraph records
+
+    Like find_all, a matching paragraph inside another is recorded too,
+    after the one it is in, and is also part of that one.
+    """
+
+    def __init__(self, classes):
+        super().__init__(convert_charrefs=True)
+        self.classes = set(classes)
+        # records in the order their paragraphs open; None until closed
+        self.records = []
+        self.taken = 0
+        # the open elements, each as [tag, has_children]
+        self.stack = []
+        self.open = []
+        self.pending = []
+
+    def handle_starttag(self, tag, attrs):
+        self.flush_data()
+        self.open_child(tag)
+        if tag == 'p':
+            classes = (dict(attrs).get('class') or '').split()
+            if self.classes.intersection(classes):
+                self.open.append(openParagraph(classes, len(self.stack),
+                                               self.taken + len(self.records)))
+                self.records.append(None)
+        if tag in void_tags:
+            self.close_child(tag)
+        else:
+            self.stack.append([tag, False])
+
+    def handle_startendtag(self, tag, attrs):
+        self.flush_data()
+        self.open_child(tag)
+        self.close_child(tag)
+
+    def handle_endtag(self, tag):
+        # like BeautifulSoup, close up to the most recent matching tag
+        # and ignore end tags that were never opened
+        self.flush_data()
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                break
+        else:
+            return
+        while len(self.stack) > i:
+            name, _ = self.stack.pop()
+            if self.open and self.open[-1].depth == len(self.stack):
+                self.close_paragraph()
+            self.close_child(name)
+
+    def handle_data(self, data):
+        if self.open:
+            self.pending.append(data)
+
+    def handle_comment(self, data):
+        self.flush_data()
+        if self.open:
+            for paragraph in self.open:
+                if paragraph.is_child(self.stack):
+                    paragraph.children.append((collapse(data), comment))
+            self.stack[-1][1] = True
+
+    def close(self):
+        super().close()
+        self.flush_data()
+        # a paragraph left open at the end of the document still counts
+        while self.open:
+            self.close_paragraph()
+
+    def flush_data(self):
+        data = ''.join(self.pending)
+        self.pending.clear()
+        if not data:
+            return
+        data = collapse(data)
+        for paragraph in self.open:
+            paragraph.add_text(data, self.stack)
+        self.stack[-1][1] = True
+
+    def close_paragraph(self):
+        paragraph = self.open.pop()
+        self.records[paragraph.index - self.taken] = paragraph.record()
+
+    def open_child(self, tag):
+        if not self.open:
+            return
+        parent = self.stack[-1]
+        for paragraph in self.open:
+            paragraph.open_child(tag, self.stack, parent[1])
+        parent[1] = True
+
+    def close_child(self, tag):
+        for paragraph in self.open:
+            paragraph.close_child(tag, self.stack)
+
+    def take_records(self):
+        """The records so far, up to the first paragraph still open"""
+        done = 0
+        while done < len(self.records) and self.records[done] is not None:
+            done += 1
+        records = self.records[:done]
+        del self.records[:done]
+        self.taken += done
+        return records
+
+def iter_paragraphs(markup, classes, chunk_size=1 << 16):
+    """Yield a Paragraph for each <p> with one of the given classes
+
+    markup is a string or an open text file, which is read in chunks so
+    the whole document is never held in memory.
+    """
+    parser = paragraphParser(classes)
+    if isinstance(markup, str):
+        chunks = [markup]
+    else:
+        chunks = iter(lambda: markup.read(chunk_size), '')
+    for chunk in chunks:
+        parser.feed(chunk)
+        yield from parser.take_records()
+    parser.close()
+    yield from parser.take_records()
@@ -0,0 +1,88 @@
+import json
+import os.path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+##
+# The similarity matrix in binary, for tools that only look at a few
+# ingredients.  Similarities are rounded to 3 places anyway, so each is
+# kept as a uint16 count of thousandths, in a directory:
+#
+#   names.json        the ingredients; a name's id is its row and column
+#   similarity.npy    n x n uint16, memory-mapped on open
+#   meta.json         how it was computed, {"engine": ..., "metric": ...}
+#   inputs/           the weights it was computed from, as in clean.matrix/,
+#                     so a later run can tell what changed
+#
+# Opening it reads the names only, a query reads the rows it asks for,
+# and processes opening the same store share its pages.  The metrics are
+# symmetric, so a row is also the column of the same ingredient.
+##
+
+scale = 1000
+
+class storeWriter:
+    """Write a store a block of rows at a time, in any order"""
+
+    def __init__(self, path, names):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'names.json'), 'w') as f:
+            json.dump(list(names), f)
+        n = len(names)
+        self.matrix = np.lib.format.open_memmap(os.path.join(path, 'similarity.npy'),
+                                                mode='w+', dtype=np.uint16, shape=(n, n))
+
+    def write(self, start, block):
+        block = block.toarray() if sparse.issparse(block) else np.asarray(block)
+        self.matrix[start:start + len(block)] = np.rint(np.clip(block, 0, 1) * scale)
+
+    def close(self):
+        self.matrix.flush()
+        del self.matrix
+
+def write_store(path, names, sim, chunk=1024):
+    """Write a square similarity matrix, dense or sparse, a chunk of rows at a time"""
+    writer = storeWriter(path, names)
+    for start in range(0, len(names), chunk):
+        writer.write(start, sim[start:start + chunk])
+    writer.close()
+
+def write_meta(path, **meta):
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+def read_meta(path):
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+class similarityStore:
+    """A memory-mapped similarity store, queried by ingredient name"""
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'names.json')) as f:
+            self.names = json.load(f)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.matrix = np.load(os.path.join(path, 'similarity.npy'), mmap_mode='r')
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def row(self, name):
+        """Similarities of one ingredient to every other, as a Series"""
+        return pd.Series(self.matrix[self.ids[name]] / scale, index=self.names)
+
+    def frame(self, names):
+        """Columns of the similarity matrix for the given ingredients
+
+        Laid out like pd.read_json of similarity.json, restricted to names.
+        """
+        ids = [self.ids[name] for name in names]
+        return pd.DataFrame(self.matrix[ids].T / scale, index=self.names, columns=list(names))
+
+def is_store(path):
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, 'similarity.npy'))
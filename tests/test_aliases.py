@@ -0,0 +1,24 @@
+from src.utils.aliases import find_aliases
+
+def test_inverted_and_typos_merge():
+    names = ['cheese, parmesan', 'parmesan cheese', 'truffels', 'truffles',
+             'black truffels', 'black truffles']
+    counts = {'truffles': 2, 'black truffles': 2}
+    assert find_aliases(names, counts) == {
+        'cheese, parmesan': 'parmesan cheese',
+        'truffels': 'truffles',
+        'black truffels': 'black truffles',
+    }
+
+def test_plurals_and_word_order_stay_apart():
+    names = ['pepper', 'peppers', 'chocolate milk', 'milk chocolate']
+    assert find_aliases(names) == {}
+
+def test_keeps_the_most_mentioned():
+    assert find_aliases(['safron', 'saffron'], {'saffron': 3}) == {'safron': 'saffron'}
+    assert find_aliases(['safron', 'saffron'], {'safron': 3}) == {'saffron': 'safron'}
+    assert find_aliases(['safron', 'saffron'], sources=['safron']) == {'saffron': 'safron'}
+
+def test_ties_are_reported_not_merged(capsys):
+    assert find_aliases(['safron', 'saffron']) == {}
+    assert 'saffron, safron' in capsys.readouterr().out
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from src.pipeline.clean import apply_weight, clean_records, dedupe_bible, normalize_bible
+
+def bible(general_first):
+    records = [
+        ('ING20', {'ing20': 0, 'honey': 4, '*sugar': 1, 'mint': 4, 'figs': 3}),
+        ('ING20 — IN GENERAL', {'ing20 — in general': 0, 'honey': 2, 'sugar': 4,
+                                     'mint': 4, 'thyme': 3}),
+    ]
+    return dict(records[::-1] if general_first else records)
+
+@pytest.mark.parametrize('general_first', [False, True])
+def test_conflicting_ranks_keep_the_stronger(general_first):
+    normalized = bible(general_first)
+    normalize_bible(normalized)
+    assert list(normalized) == ['ing20']
+    entries = normalized['ing20']
+    assert entries['honey'] == 2
+    assert entries['sugar'] == 1
+    assert entries['mint'] == 4
+    assert entries['figs'] == 3 and entries['thyme'] == 3
+
+def test_dedupe_keeps_the_stronger_too():
+    merged = {'parmesan cheese': {'basil': 3, 'figs': 2}, 'cheese, parmesan': {'basil': 1}}
+    dedupe_bible(merged, {'cheese, parmesan': 'parmesan cheese'})
+    assert merged == {'parmesan cheese': {'basil': 1, 'figs': 2}}
+
+def test_renamed_entry_keeps_the_stronger():
+    normalized = {'BASIL': {'basil': 0, 'garlic': 2, '*garlic': 4, 'lemon': 3}}
+    normalize_bible(normalized)
+    assert normalized['basil']['garlic'] == 2
+
+@pytest.mark.parametrize('general_first', [False, True])
+def test_ndjson_merges_alike(tmp_path, general_first):
+    records = bible(general_first)
+    path = tmp_path / 'bible.ndjson'
+    with open(path, 'w') as f:
+        for key, entries in records.items():
+            f.write(json.dumps({key: entries}) + '\n')
+    normalized = dict(records)
+    normalize_bible(normalized)
+    apply_weight(normalized)
+    assert dict(clean_records(str(path), n=0)) == normalized
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+from src.pipeline.parse import (iter_ingredients, parse_chapters, parse_ptag, parseState,
+                                read_paragraphs)
+
+##
+# Chapters parsed on their own, then merged, against one pass over all of
+# them, as the book was parsed before --jobs
+##
+
+chapters = {
+    'basil': """<html><body>
+<p class="lh1">BASIL</p>
+<p class="ul3">Season: summer</p>
+<p class="ul"><strong>*GARLIC</strong></p>
+<p class="ul"><strong>OLIVE OIL</strong></p>
+<p class="ul">black pepper</p>
+</body></html>""",
+    # opens with a title that names no ingredient, so thyme is still basil's
+    'walnuts': """<html><body>
+<p class="lh">walnut oil <strong>(See Oil, Walnut)</strong></p>
+<p class="ul">thyme</p>
+<p class="lh1">WALNUTS</p>
+<p class="ul"><strong>honey</strong></p>
+</body></html>""",
+    # opens with paragraphs and no title at all
+    'leading': """<html><body>
+<p class="ul">salt</p>
+<p class="lh1">ANISE <strong>(See also Anise, Star, and Fennel)</strong></p>
+<p class="ul">fennel</p>
+</body></html>""",
+}
+
+def write_chapters(path, names):
+    files = []
+    for name in names:
+        files.append(str(path / (name + '.html')))
+        with open(files[-1], 'w') as f:
+            f.write(chapters[name])
+    return files
+
+def serial(files):
+    bible, state = {}, parseState()
+    for input_file in files:
+        for ptag in read_paragraphs(input_file):
+            parse_ptag(bible, state, ptag)
+    return bible
+
+@pytest.mark.parametrize('names', [
+    ['basil', 'walnuts'],
+    ['basil', 'leading'],
+    ['basil', 'walnuts', 'leading'],
+])
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_chunked_matches_serial(tmp_path, names, jobs):
+    files = write_chapters(tmp_path, names)
+    expected = serial(files)
+    assert json.dumps(parse_chapters(files, jobs=jobs)) == json.dumps(expected)
+
+def test_untitled_title_continues_previous_chapter(tmp_path):
+    files = write_chapters(tmp_path, ['basil', 'walnuts'])
+    bible = parse_chapters(files)
+    assert list(bible) == ['BASIL', 'WALNUTS']
+    assert 'thyme' in bible['BASIL']
+    assert 'thyme' not in bible['WALNUTS']
+
+def test_ingredients_match_serial(tmp_path):
+    files = write_chapters(tmp_path, ['basil', 'walnuts', 'leading'])
+    assert json.dumps(dict(iter_ingredients(files))) == json.dumps(serial(files))
@@ -3,6 +3,15 @@ import pandas as pd
 import numpy as np
 import os.path
 
+from src.utils.store import is_store, similarityStore
+
+
+def similarity_columns(store, sim_matrix, names):
+    """Columns of the similarity matrix for names, from the store or the json"""
+    if store:
+        return store.frame(names)
+    return sim_matrix[names]
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -15,7 +24,8 @@ def main():
         '-i', '--input',
         default='data/similarity.json',
         metavar='FILE',
-        help='input similarity matrix (default: data/similarity.json)'
+        help='input similarity matrix, json or a similarity.store/ directory '
+             '(default: data/similarity.json)'
     )
     parser.add_argument(
         '-o', '--output',
@@ -41,7 +51,7 @@ def main():
     args = parser.parse_args()
 
     # check the input file exists
-    if not os.path.isfile(args.input):
+    if not os.path.exists(args.input):
         parser.error(f'input file does not exist: {args.input}')
 
     # set defaults for ingredients if not provided
@@ -54,16 +64,23 @@ def main():
     output_file = args.output
     depth = args.depth
 
-    # read the input file
-    sim_matrix = pd.read_json(input_file)
-    print(sim_matrix)
+    # read the input file; a store is only read for the columns asked for
+    store, sim_matrix = None, None
+    if is_store(input_file):
+        store = similarityStore(input_file)
+    else:
+        sim_matrix = pd.read_json(input_file)
+        # a --top-k or --min-sim file leaves out pairs, which are 0
+        sim_matrix = sim_matrix.fillna(0)
+        print(sim_matrix)
 
     # now we sort the similarity matrix by the ingredients
     # and then get the top depth=n ingredients
     suggested_ingredients = []
     for i in range(depth):
         # get the top n ingredients
-        top_n = sim_matrix[ingredients].mean(axis=1).sort_values(ascending=False)
+        columns = similarity_columns(store, sim_matrix, ingredients)
+        top_n = columns.mean(axis=1).sort_values(ascending=False)
         top_n = top_n.drop(ingredients)
         suggested_ingredients.append(top_n.index.values[0])
         ingredients.append(top_n.index.values[0])
@@ -74,7 +91,7 @@ def main():
 
     # print the suggested ingredients as a slice of the
     # similarity matrix, in both columns and rows
-    suggested_sim_matrix = sim_matrix[ingredients]
+    suggested_sim_matrix = similarity_columns(store, sim_matrix, ingredients)
     suggested_sim_matrix = suggested_sim_matrix.loc[ingredients]
     # sort the suggested ingredients as an adjacency matrix:
     suggested_sim_matrix = suggested_sim_matrix.sort_index(axis=0)
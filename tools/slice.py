@@ -0,0 +1,142 @@
+import argparse
+import json
+import os.path
+
+import numpy as np
+
+from src.utils.adjacency import adjacencyIndex, is_index, write_index
+
+
+def index_from_json(nodes, edges_file, path):
+    """Build the adjacency index graph.py would have written, from edges.json"""
+    names = [node['id'] for node in nodes]
+    ids = {name: i for i, name in enumerate(names)}
+    with open(edges_file) as f:
+        edges = json.load(f)
+    sources = np.array([ids[edge['from']] for edge in edges], dtype=np.int64)
+    targets = np.array([ids[edge['to']] for edge in edges], dtype=np.int64)
+    weights = np.array([edge['weight'] for edge in edges])
+    reciprocal = None
+    if edges and 'reciprocal' in edges[0]:
+        reciprocal = np.array([edge['reciprocal'] for edge in edges])
+    write_index(path, names, sources, targets, weights, reciprocal)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='slice.py',
+        description='Slice the ingredient graph to the neighbourhood of a few seed ingredients',
+        epilog='Example: python slice.py -i data/nodes.json -e data/edges.json -k 2 -m 10 '
+               '-n basil -n garlic'
+    )
+
+    parser.add_argument(
+        '-i', '--nodes',
+        default='data/nodes.json',
+        metavar='FILE',
+        help='input nodes JSON (default: data/nodes.json)'
+    )
+    parser.add_argument(
+        '-e', '--edges',
+        default='data/edges.json',
+        metavar='FILE',
+        help='input edges JSON, only read if it has no index (default: data/edges.json)'
+    )
+    parser.add_argument(
+        '-x', '--index',
+        metavar='DIR',
+        help='adjacency index written by graph.py '
+             '(default: next to the edges, e.g. data/edges.index)'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        default='data/slice.json',
+        metavar='FILE',
+        help='output JSON of the nodes and edges in the slice (default: data/slice.json)'
+    )
+    parser.add_argument(
+        '-n', '--node',
+        action='append',
+        dest='seed_nodes',
+        metavar='NODE',
+        help='seed node (can specify multiple times)'
+    )
+    parser.add_argument(
+        '-k', '--hops',
+        type=int,
+        default=1,
+        metavar='N',
+        help='how many edges away from a seed to go (default: 1)'
+    )
+    parser.add_argument(
+        '-w', '--min-weight',
+        type=float,
+        metavar='X',
+        help='only follow and keep edges of at least this weight'
+    )
+    parser.add_argument(
+        '-m', '--max-neighbours',
+        type=int,
+        metavar='N',
+        help='from each node, only follow its N heaviest edges'
+    )
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.nodes):
+        parser.error(f'input file does not exist: {args.nodes}')
+
+    if args.seed_nodes is None:
+        seeds = ['basil', 'garlic', 'olive oil']
+    else:
+        seeds = [node.lower() for node in args.seed_nodes]
+
+    with open(args.nodes) as f:
+        nodes = json.load(f)
+
+    # the index is read instead of the edges; an older graph.py run
+    # without one, or one whose nodes have changed since, gets it built
+    # again from the edges
+    index_dir = args.index or os.path.splitext(args.edges)[0] + '.index'
+    index = adjacencyIndex(index_dir) if is_index(index_dir) else None
+    if index is None or index.names != [node['id'] for node in nodes]:
+        if not os.path.exists(args.edges):
+            if index is None:
+                parser.error(f'no adjacency index in {index_dir}, and no edges file: {args.edges}')
+            parser.error(f'{index_dir} is not the index of {args.nodes}, and no edges file: '
+                         f'{args.edges}')
+        # let go of the memory-mapped arrays before they are rewritten
+        index = None
+        print(f'Building the adjacency index in {index_dir}')
+        index_from_json(nodes, args.edges, index_dir)
+        index = adjacencyIndex(index_dir)
+
+    missing = [seed for seed in seeds if seed not in index]
+    if missing:
+        print('Not in the graph: {}'.format(', '.join(missing)))
+
+    ids, sources, targets, weights, reciprocal = index.slice(
+        seeds, args.hops, args.min_weight, args.max_neighbours)
+
+    names = index.names
+    edges = [{'from': names[a], 'to': names[b], 'weight': w}
+             for a, b, w in zip(sources.tolist(), targets.tolist(), weights.tolist())]
+    if reciprocal is not None:
+        for edge, flag in zip(edges, reciprocal.tolist()):
+            edge['reciprocal'] = flag
+
+    print('Number of nodes: {}'.format(len(ids)))
+    print('Number of edges: {}'.format(len(edges)))
+
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'nodes': [nodes[i] for i in ids.tolist()], 'edges': edges},
+                  f, indent=2, sort_keys=True)
+
+    return 0
+
+
+if __name__ == '__main__':
+    exit(main())
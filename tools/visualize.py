@@ -6,6 +6,8 @@ import numpy as np
 import networkx as nx
 import matplotlib.pyplot as plt
 
+from src.utils.store import is_store, similarityStore
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -24,7 +26,8 @@ def main():
         '-s', '--similarity',
         default='data/similarity.json',
         metavar='FILE',
-        help='input similarity matrix JSON (default: data/similarity.json)'
+        help='input similarity matrix JSON, or a similarity.store/ directory '
+             '(default: data/similarity.json)'
     )
     parser.add_argument(
         '-n', '--node',
@@ -51,8 +54,14 @@ def main():
     with open(args.clean) as f:
         clean_data = json.load(f)
 
-    with open(args.similarity) as f:
-        sim_data = json.load(f)
+    # a store is only read for the one ingredient looked up
+    store = None
+    if is_store(args.similarity):
+        store = similarityStore(args.similarity)
+    else:
+        with open(args.similarity) as f:
+            sim_data = json.load(f)
+        bf = pd.DataFrame(sim_data).fillna(0).astype(float)
 
     # Extract numeric data from clean
     clean_numeric = {}
@@ -62,7 +71,6 @@ def main():
 
     # Convert to DataFrames
     df = pd.DataFrame(clean_numeric).fillna(0).astype(float)
-    bf = pd.DataFrame(sim_data).fillna(0).astype(float)
 
     # Set seed nodes
     if args.seed_nodes is None:
@@ -82,7 +90,7 @@ def main():
         v = []
         n = 11
         print("Generating seed list from top matching ingredients")
-        Bf = bf[a].nlargest(n)
+        Bf = (store.row(a) if store else bf[a]).nlargest(n)
         for idx in Bf.index:
             v.append(idx)
 